@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+Measures how long a Bitcoind tab refresh takes against a local fake bitcoind
+with a fixed latency per request, comparing batched calls over a keep-alive
+connection with one request and connection per call, and summary calls
+with fetching the full mempool and block
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from rpc import JsonRpcClient
+from tabs.bitcoin import Bitcoind
+from fake_bitcoind import FakeBitcoind
+
+class UnbatchedClient(JsonRpcClient):
+    """
+    Sends every call as a separate request on a new connection
+    """
+    def batch(self, calls):
+        results = []
+        
+        for call in calls:
+            results += JsonRpcClient.batch(self, [ call ])
+            self.close()
+        
+        return results
+
+def run(fake, client_class, polls):
+    tab = Bitcoind({"host": fake.get_url(), "username": "user", "password": "password"})
+    tab.client.__class__ = client_class
+    
+    fake.reset_stats()
+    
+    start_time = time.time()
+    for i in range(0, polls):
+        stats = tab.fetch_stats()
+    
+    duration = (time.time() - start_time) / polls
+    
+    tab.client.close()
+    
+    return duration, dict(fake.stats), stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", "-l", help="latency of each request in seconds (default=0.2)",
+                        type=float, default=0.2)
+    parser.add_argument("--polls", "-n", help="how many times to refresh (default=5)",
+                        type=int, default=5)
+    parser.add_argument("--mempool-size", "-m", help="amount of transactions in the mempool (default=20000)",
+                        type=int, default=20000)
+    args = parser.parse_args()
+    
+    fake = FakeBitcoind(latency=args.latency, mempool_size=args.mempool_size).start()
+    
+    for name, client_class, summary_calls in (("unbatched", UnbatchedClient, False),
+                                              ("batched", JsonRpcClient, False),
+                                              ("summary", JsonRpcClient, True)):
+        fake.summary_calls = summary_calls
+        duration, stats, _ = run(fake, client_class, args.polls)
+        
+        print "%-10s %.3f s per refresh, %.1f requests, %.1f connections, %d bytes per refresh" % \
+            (name, duration, float(stats["requests"]) / args.polls,
+             float(stats["connections"]) / args.polls, stats["bytes_sent"] / args.polls)
+    
+    # A failing call shouldn't prevent using the results of the others
+    fake.failing_methods.add("getpeerinfo")
+    _, _, stats = run(fake, JsonRpcClient, 1)
+    
+    print "with getpeerinfo failing: errors %s, block count %d" % (stats["errors"], stats["block_count"])
+    
+    fake.stop()
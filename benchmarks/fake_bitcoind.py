@@ -0,0 +1,137 @@
+"""
+A local stand-in for bitcoind's JSON-RPC interface
+"""
+import json
+import time
+import hashlib
+import threading
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+class FakeBitcoindHandler(BaseHTTPRequestHandler):
+    # Required for keep-alive connections
+    protocol_version = "HTTP/1.1"
+    
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        
+        self.server.fake.count("connections")
+    
+    def do_POST(self):
+        fake = self.server.fake
+        
+        body = self.rfile.read(int(self.headers.getheader("content-length")))
+        request = json.loads(body)
+        
+        fake.count("requests")
+        time.sleep(fake.latency)
+        
+        if isinstance(request, list):
+            response = [ fake.handle_call(call) for call in request ]
+        else:
+            response = fake.handle_call(request)
+        
+        data = json.dumps(response)
+        fake.count("bytes_sent", len(data))
+        
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def log_message(self, format, *args):
+        pass
+
+class FakeBitcoindServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    
+    def handle_error(self, request, client_address):
+        pass
+
+class FakeBitcoind:
+    """
+    Answers JSON-RPC calls after a fixed latency per HTTP request. Calls to
+    methods listed in failing_methods return an error. Without summary_calls,
+    getmempoolinfo and getblockheader are missing like on older versions
+    """
+    def __init__(self, latency=0.0, mempool_size=1000, peer_count=8, summary_calls=True):
+        self.latency = latency
+        self.summary_calls = summary_calls
+        self.mempool_size = mempool_size
+        self.peer_count = peer_count
+        self.block_count = 300000
+        self.failing_methods = set()
+        
+        self.stats = {"connections": 0, "requests": 0, "calls": 0, "bytes_sent": 0}
+        self.lock = threading.Lock()
+        
+        self.server = FakeBitcoindServer(("127.0.0.1", 0), FakeBitcoindHandler)
+        self.server.fake = self
+    
+    def start(self):
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        
+        return self
+    
+    def stop(self):
+        self.server.shutdown()
+    
+    def get_url(self):
+        return "http://127.0.0.1:%d" % self.server.server_address[1]
+    
+    def count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+    
+    def reset_stats(self):
+        with self.lock:
+            for name in self.stats:
+                self.stats[name] = 0
+    
+    def get_block_hash(self, height):
+        return hashlib.sha256(str(height)).hexdigest()
+    
+    def handle_call(self, call):
+        self.count("calls")
+        
+        method = call["method"]
+        params = call.get("params", [])
+        
+        if not hasattr(self, "rpc_%s" % method) or \
+           (not self.summary_calls and method in ("getmempoolinfo", "getblockheader")):
+            return {"id": call.get("id"), "result": None,
+                    "error": {"code": -32601, "message": "Method not found"}}
+        
+        if method in self.failing_methods:
+            return {"id": call.get("id"), "result": None,
+                    "error": {"code": -1, "message": "Method failed: %s" % method}}
+        
+        return {"id": call.get("id"), "result": getattr(self, "rpc_%s" % method)(*params), "error": None}
+    
+    def rpc_getblockcount(self):
+        return self.block_count
+    
+    def rpc_getbestblockhash(self):
+        return self.get_block_hash(self.block_count)
+    
+    def rpc_getpeerinfo(self):
+        return [ {"addr": "10.0.0.%d:8333" % i, "addrlocal": "192.0.2.1:8333", "inbound": i % 3 == 0}
+                 for i in range(0, self.peer_count) ]
+    
+    def rpc_getrawmempool(self):
+        return [ hashlib.sha256("tx%d" % i).hexdigest() for i in range(0, self.mempool_size) ]
+    
+    def rpc_getmempoolinfo(self):
+        return {"size": self.mempool_size, "bytes": self.mempool_size * 250}
+    
+    def rpc_getblockheader(self, block_hash):
+        return {"hash": block_hash, "height": self.block_count, "time": 1400000000 + self.block_count * 600,
+                "nTx": 2000}
+    
+    def rpc_getblock(self, block_hash):
+        return {"hash": block_hash, "height": self.block_count, "time": 1400000000 + self.block_count * 600,
+                "tx": [ hashlib.sha256("block%d" % i).hexdigest() for i in range(0, 2000) ]}
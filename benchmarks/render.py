@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""
+Measures what drawing the header, each tab and changing the tab costs.
+The screen is replaced with a sink that only counts what is written to it and
+the tabs are given fixed data instead of collecting it, so runs can be compared
+with each other. The results are written as JSON
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from context import ScreenContext
+from collector import Snapshot
+from pacing import PROFILES
+from header import Header
+from tabs.sysinfo import SystemStats, DiskUsage
+from tabs.uptime import WebsiteUptime
+from tabs.bitcoin import Bitcoind, BitcoinPrice
+
+class CaptureTransport:
+    """
+    Takes the place of SerialTransport, counting the bytes written to it
+    """
+    def __init__(self):
+        self.bytes_written = 0
+        self.write_count = 0
+    
+    def open(self):
+        return self
+    
+    def write(self, data):
+        self.bytes_written += len(data)
+        self.write_count += 1
+        
+        return self
+    
+    def close(self):
+        pass
+
+class CountingPopen(subprocess.Popen):
+    """
+    Counts the subprocesses started while drawing
+    """
+    count = 0
+    
+    def __init__(self, *args, **kwargs):
+        CountingPopen.count += 1
+        
+        subprocess.Popen.__init__(self, *args, **kwargs)
+
+class BenchmarkContext(ScreenContext):
+    """
+    A ScreenContext that draws into a CaptureTransport. Besides what is written,
+    the time the writer thread waits on the pacer and the time drawing waits for
+    room in the writer's queue are counted
+    """
+    def open_port(self):
+        self.transport = CaptureTransport()
+        ScreenContext.open_port(self)
+    
+    def get_counters(self):
+        return {"wall_time": time.time(),
+                "pacer_wait_time": self.pacer.time_waited,
+                "queue_wait_time": self.writer.time_blocked,
+                "bytes": self.transport.bytes_written,
+                "writes": self.transport.write_count,
+                "subprocesses": CountingPopen.count}
+
+def create_tabs():
+    """
+    Create the tabs with fixed data in their snapshots
+    """
+    now = time.time()
+    
+    system_stats = SystemStats()
+    system_stats.collector.snapshot = Snapshot({"cpu_usages": (0.12, 0.48, 0.75, 0.05),
+                                                "total_ram": 2 * 1024**3,
+                                                "used_ram": 768 * 1024**2,
+                                                "boot_time": now - 3 * 86400,
+                                                "cpu_history": numpy.linspace(0.0, 0.8, 600 * 4).reshape(600, 4),
+                                                "ram_history": numpy.linspace(0.3, 0.4, 600)}, now, None)
+    
+    disk_usage = DiskUsage()
+    disk_usage.collector.snapshot = Snapshot({"/": {"total": 16 * 1024**3, "used": 9 * 1024**3, "stale": False},
+                                              "/boot": {"total": 128 * 1024**2, "used": 20 * 1024**2, "stale": False},
+                                              "/media/storage": {"total": 1024**4, "used": 800 * 1024**3, "stale": True},
+                                              "/media/nfs": {"total": None, "used": None, "stale": True}},
+                                             now, None)
+    
+    websites = [ {"name": "Website %d" % i, "url": "http://127.0.0.1/%d" % i} for i in range(0, 5) ]
+    
+    website_uptime = WebsiteUptime({"websites": websites})
+    website_uptime.collector.snapshot = Snapshot({"website_status": dict([ (website["name"], i != 3)
+                                                                            for i, website in enumerate(websites) ]),
+                                                  "downtime": dict([ (website["name"], now - 600 if i == 3 else -1)
+                                                                     for i, website in enumerate(websites) ]),
+                                                  "latency": dict([ (website["name"], (0.045 * (i + 1), 0.3 * (i + 1)))
+                                                                    for i, website in enumerate(websites) if i != 3 ])},
+                                                 now, None)
+    
+    bitcoin_price = BitcoinPrice()
+    bitcoin_price.collector.snapshot = Snapshot({"source": "Bitstamp",
+                                                 "data": {"Last": 243.21, "High": 251.0,
+                                                          "Low": 239.87, "24h avg": 245.12}}, now, None)
+    
+    bitcoind = Bitcoind({"host": "http://127.0.0.1:8332", "username": "user", "password": "password"})
+    bitcoind.collector.snapshot = Snapshot({"addrlocal": "203.0.113.5:8333",
+                                            "connections": 12,
+                                            "inbound": 4,
+                                            "outbound": 8,
+                                            "block_count": 350000,
+                                            "utx_count": 2150,
+                                            "tx_per_second": 1.73,
+                                            "last_block_time": int(now) - 300,
+                                            "errors": ()}, now, None)
+    
+    return [ system_stats, disk_usage, website_uptime, bitcoin_price, bitcoind ]
+
+def get_scenarios(tabs):
+    """
+    Returns (name, prepare, draw) tuples. prepare is called before each
+    measured frame without being measured
+    """
+    header = Header()
+    
+    def draw_tab(ctx, i):
+        header.render_header(ctx, i, tabs[i].title, len(tabs))
+        tabs[i].render_tab(ctx)
+    
+    scenarios = [ ("header", None, lambda ctx: header.render_header(ctx, 0, tabs[0].title, len(tabs))) ]
+    
+    for i, tab in enumerate(tabs):
+        scenarios.append((tab.__class__.__name__, None, lambda ctx, i=i: draw_tab(ctx, i)))
+    
+    # Change from a fully drawn tab to the next one, erasing the previous
+    # tab in the same frame like the display does
+    def prepare_change(ctx):
+        with ctx.frame():
+            draw_tab(ctx, 0)
+    
+    def change_tab(ctx):
+        ctx.erase_tab_area()
+        draw_tab(ctx, 1)
+    
+    scenarios.append(("tab_change", prepare_change, change_tab))
+    
+    return scenarios
+
+def measure(ctx, draw):
+    """
+    Draw a single frame, returning how much each counter changed
+    """
+    start = ctx.get_counters()
+    
+    with ctx.frame():
+        draw(ctx)
+        
+    # Include the time taken to send the frame
+    ctx.drain()
+    
+    end = ctx.get_counters()
+    
+    return dict([ (name, end[name] - start[name]) for name in start ])
+
+def run_scenario(prepare, draw, frames, use_framebuffer, pixel_mode, pacing_profile):
+    ctx = BenchmarkContext("capture", use_framebuffer=use_framebuffer, pacing_profile=pacing_profile,
+                           pixel_mode=pixel_mode)
+    
+    # Set up the screen the same way showtime.py does
+    ctx.reset_lcd().set_rotation(0)
+    
+    results = []
+    
+    for i in range(0, frames):
+        if prepare is not None:
+            prepare(ctx)
+        
+        results.append(measure(ctx, draw))
+    
+    # The first frame draws everything, the frames after it can skip what hasn't changed
+    repeat = {}
+    
+    if len(results) > 1:
+        for name in results[0]:
+            repeat[name] = sum([ result[name] for result in results[1:] ]) / float(len(results) - 1)
+    
+    return {"first": results[0], "repeat": repeat}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", "-n", help="how many frames to draw in each scenario (default=5)",
+                        type=int, default=5)
+    parser.add_argument("--pacing", help="pacing profile to use (default=link)",
+                        choices=sorted(PROFILES.keys()), default="link")
+    parser.add_argument("--output", "-o", help="file to write the results to (default=stdout)",
+                        type=str, default=None)
+    args = parser.parse_args()
+    
+    subprocess.Popen = CountingPopen
+    
+    tabs = create_tabs()
+    
+    results = {"frames": args.frames,
+               "pacing": args.pacing,
+               "scenarios": {}}
+    
+    for mode, use_framebuffer, pixel_mode in (("framebuffer", True, False),
+                                              ("direct", False, False),
+                                              ("pixel", False, True)):
+        results["scenarios"][mode] = {}
+        
+        for name, prepare, draw in get_scenarios(tabs):
+            results["scenarios"][mode][name] = run_scenario(prepare, draw, args.frames,
+                                                            use_framebuffer, pixel_mode,
+                                                            PROFILES[args.pacing])
+    
+    output = json.dumps(results, indent=4, sort_keys=True)
+    
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print output
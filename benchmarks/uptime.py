@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+Compares checking websites one at a time with checking them concurrently
+using WebsiteUptime against a local HTTP server that delays its responses,
+in each of the probe modes
+"""
+import os
+import sys
+import time
+import socket
+import threading
+import argparse
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from tabs.uptime import WebsiteUptime
+from probe import PROBE_MODES
+
+class DelayingHandler(BaseHTTPRequestHandler):
+    """
+    Responds to /<delay> after waiting for delay seconds. HEAD requests are
+    delayed the same way, so that every probe mode waits for the response
+    """
+    def do_GET(self):
+        self.respond()
+        self.wfile.write("OK")
+    
+    def do_HEAD(self):
+        self.respond()
+    
+    def respond(self):
+        time.sleep(float(self.path.strip("/")))
+        
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+    
+    def log_message(self, format, *args):
+        pass
+
+class DelayingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    
+    # With the default backlog of 5, concurrent connections are dropped and
+    # retried about a second later, which would be timed as well
+    request_queue_size = 128
+    
+    def handle_error(self, request, client_address):
+        # Clients that timed out have already closed the connection
+        pass
+
+def get_closed_port():
+    """
+    Returns a local port nothing is listening on
+    """
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    
+    return port
+
+def run_round(websites, concurrency, mode):
+    tab = WebsiteUptime({"websites": websites,
+                         "concurrency": concurrency,
+                         "probe": mode,
+                         "timeout": 2,
+                         "round_timeout": 600})
+    
+    start_time = time.time()
+    uptime = tab.fetch_uptime()
+    
+    up = len([ status for status in uptime["website_status"].values() if status ])
+    
+    return time.time() - start_time, up
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--websites", "-w", help="how many websites to check (default=50)",
+                        type=int, default=50)
+    parser.add_argument("--down", "-d", help="how many of the websites are down (default=5)",
+                        type=int, default=5)
+    parser.add_argument("--concurrency", "-c", help="concurrency of the concurrent round (default=50)",
+                        type=int, default=50)
+    parser.add_argument("--probe", "-p", help="probe mode to compare, all of them if not given",
+                        choices=sorted(PROBE_MODES.keys()), default=None)
+    args = parser.parse_args()
+    
+    server = DelayingServer(("127.0.0.1", 0), DelayingHandler)
+    
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    
+    up_url = "http://127.0.0.1:%d" % server.server_address[1]
+    down_url = "http://127.0.0.1:%d" % get_closed_port()
+    
+    websites = []
+    for i in range(0, args.websites):
+        if i < args.down:
+            # Half of the broken websites refuse connections, the other half time out
+            if i % 2 == 0:
+                url = "%s/0" % down_url
+            else:
+                url = "%s/5" % up_url
+        else:
+            url = "%s/%.2f" % (up_url, 0.05 + (i % 10) * 0.02)
+        
+        websites.append({"name": "Website %d" % i, "url": url})
+    
+    # Websites that time out are up when only connecting to them
+    for mode in ([ args.probe ] if args.probe else [ "get", "head", "range", "tcp" ]):
+        for concurrency in (1, args.concurrency):
+            duration, up = run_round(websites, concurrency, mode)
+            
+            print "%-5s concurrency %3d: %6.2f s, %d / %d up" % (mode, concurrency, duration, up, len(websites))
+    
+    server.shutdown()
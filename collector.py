@@ -0,0 +1,282 @@
+from collections import namedtuple
+
+import threading
+import Queue
+import time
+import traceback
+
+from metrics import registry
+
+FETCH_SECONDS = registry.histogram("showtime_collector_fetch_seconds",
+                                   "Time taken to fetch data for a tab", label_names=("collector",))
+FETCH_ERRORS = registry.counter("showtime_collector_errors_total",
+                                "Failed data fetches", label_names=("collector",))
+
+class Snapshot(namedtuple("Snapshot", [ "data", "timestamp", "error" ])):
+    """
+    The result of a collector run. data is None until the first successful run,
+    after which a failed run keeps the previous data and timestamp but sets error.
+    The data of a published snapshot must never be modified
+    """
+    def get_age(self):
+        """
+        Returns how many seconds ago the data was collected
+        """
+        return time.time() - self.timestamp
+
+class Collector:
+    """
+    Calls fetch every interval seconds off the render path and publishes
+    the returned data as a snapshot
+    """
+    def __init__(self, name, fetch, interval):
+        self.name = name
+        self.fetch = fetch
+        self.interval = interval
+        
+        self.snapshot = Snapshot(None, 0, None)
+        
+        # When the collector should run next
+        self.next_run = 0
+        
+        # Whether the collector is queued or running. A collector is never run
+        # concurrently with itself, so fetch can keep state between runs
+        self.busy = False
+        
+        # Called with the collector after each run
+        self.listeners = []
+    
+    def add_listener(self, listener):
+        """
+        Call listener with the collector whenever a new snapshot has been published.
+        It's called on the worker thread, so it should return quickly
+        """
+        self.listeners.append(listener)
+    
+    def run(self):
+        """
+        Fetch new data and publish it
+        """
+        start_time = time.time()
+        
+        try:
+            data = self.fetch()
+        except Exception as e:
+            print "Collector %s failed: %s" % (self.name, e)
+            traceback.print_exc()
+            
+            FETCH_ERRORS.inc(1, self.name)
+            
+            self.snapshot = Snapshot(self.snapshot.data, self.snapshot.timestamp, e)
+        else:
+            self.snapshot = Snapshot(data, time.time(), None)
+            
+        FETCH_SECONDS.observe(time.time() - start_time, self.name)
+        
+        for listener in self.listeners:
+            listener(self)
+    
+    def is_stale(self):
+        """
+        Returns True if the data hasn't been refreshed for several intervals
+        """
+        return self.snapshot.data is not None and self.snapshot.get_age() > self.interval * 3
+
+class CollectorPool:
+    """
+    Runs collectors on a pool of worker threads when they are due
+    """
+    def __init__(self, worker_count=4):
+        self.worker_count = worker_count
+        
+        self.collectors = []
+        self.queue = Queue.Queue()
+        
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+    
+    def add(self, collector):
+        with self.lock:
+            self.collectors.append(collector)
+        
+        self.wakeup.set()
+        
+        return self
+    
+    def start(self):
+        """
+        Start the scheduler and worker threads. They are daemon threads,
+        so they won't prevent the process from exiting
+        """
+        for i in range(0, self.worker_count):
+            self.start_thread(self.work, "collector-worker-%d" % i)
+        
+        self.start_thread(self.schedule, "collector-scheduler")
+        
+        return self
+    
+    def start_thread(self, target, name):
+        thread = threading.Thread(target=target, name=name)
+        thread.daemon = True
+        thread.start()
+    
+    def schedule(self):
+        while True:
+            self.wakeup.clear()
+            
+            current_time = time.time()
+            next_wakeup = current_time + 60
+            
+            with self.lock:
+                for collector in self.collectors:
+                    if collector.busy:
+                        continue
+                    
+                    if collector.next_run <= current_time:
+                        collector.busy = True
+                        self.queue.put(collector)
+                    else:
+                        next_wakeup = min(next_wakeup, collector.next_run)
+            
+            self.wakeup.wait(max(next_wakeup - time.time(), 0.01))
+    
+    def work(self):
+        while True:
+            collector = self.queue.get()
+            
+            collector.run()
+            
+            with self.lock:
+                collector.next_run = time.time() + collector.interval
+                collector.busy = False
+            
+            # Let the scheduler know when the collector should run next
+            self.wakeup.set()
+
+class DeadlineExceeded(Exception):
+    pass
+
+def run_concurrently(tasks, max_workers=8, timeout=None):
+    """
+    Run the provided callables on up to max_workers threads and return a list
+    containing a (result, error) tuple for each of them, in the same order.
+    Tasks that haven't finished when the timeout expires get a DeadlineExceeded
+    error and their results are discarded once they finish
+    """
+    results = [ (None, DeadlineExceeded("Task didn't finish in time")) ] * len(tasks)
+    
+    if len(tasks) == 0:
+        return results
+    
+    deadline = None
+    if timeout is not None:
+        deadline = time.time() + timeout
+    
+    pending = Queue.Queue()
+    for i, task in enumerate(tasks):
+        pending.put((i, task))
+    
+    lock = threading.Lock()
+    done = threading.Event()
+    state = {"remaining": len(tasks), "finished": False}
+    
+    def work():
+        while True:
+            # Don't start new tasks after the deadline
+            if deadline is not None and time.time() >= deadline:
+                return
+            
+            try:
+                i, task = pending.get_nowait()
+            except Queue.Empty:
+                return
+            
+            try:
+                result = (task(), None)
+            except Exception as e:
+                result = (None, e)
+            
+            with lock:
+                if not state["finished"]:
+                    results[i] = result
+                
+                state["remaining"] -= 1
+                
+                if state["remaining"] == 0:
+                    done.set()
+    
+    for i in range(0, min(max_workers, len(tasks))):
+        thread = threading.Thread(target=work, name="task-worker-%d" % i)
+        thread.daemon = True
+        thread.start()
+    
+    done.wait(timeout)
+    
+    with lock:
+        state["finished"] = True
+        
+        return list(results)
+
+def run_first(tasks, timeout=None, stagger=None):
+    """
+    Run the provided callables until one of them succeeds and return a (index, result)
+    tuple for it. Tasks are started stagger seconds apart, or right after the previous
+    one has failed, so that a slow task is hedged by the next one. If stagger is None
+    all of them are started at once. Raises the last error if every task fails and
+    DeadlineExceeded if none of them succeeds before the timeout
+    """
+    results = Queue.Queue()
+    
+    def work(i, task):
+        try:
+            results.put((i, task(), None))
+        except Exception as e:
+            results.put((i, None, e))
+    
+    deadline = None
+    if timeout is not None:
+        deadline = time.time() + timeout
+    
+    started = 0
+    finished = 0
+    next_start = time.time()
+    last_error = None
+    
+    while True:
+        current_time = time.time()
+        
+        while started < len(tasks) and (stagger is None or current_time >= next_start):
+            thread = threading.Thread(target=work, args=(started, tasks[started]), name="task-worker-%d" % started)
+            thread.daemon = True
+            thread.start()
+            
+            started += 1
+            next_start = current_time + (stagger or 0)
+        
+        if finished == len(tasks):
+            raise last_error or DeadlineExceeded("No tasks to run")
+        
+        # Wait until the deadline or until the next task should be started
+        wait_until = deadline
+        if started < len(tasks) and (wait_until is None or next_start < wait_until):
+            wait_until = next_start
+        
+        try:
+            if wait_until is None:
+                i, result, error = results.get()
+            else:
+                i, result, error = results.get(True, max(wait_until - time.time(), 0.001))
+        except Queue.Empty:
+            if deadline is not None and time.time() >= deadline:
+                raise DeadlineExceeded("No task succeeded in time")
+            
+            continue
+        
+        finished += 1
+        
+        if error is None:
+            return i, result
+        
+        # Start the next task right away instead of waiting for the stagger
+        last_error = error
+        next_start = time.time()
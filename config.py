@@ -1,25 +1,34 @@
-from tabs.bitcoin import BitcoinPrice, Bitcoind
-from tabs.sysinfo import SystemStats, DiskUsage
-from tabs.uptime import WebsiteUptime
-
 import os
 
-# Add any tabs you want to be visible here
+# Add any tabs you want to be visible here. Tabs are referred to by name, optionally
+# with their settings as a (name, settings) tuple, and only the modules of the tabs
+# listed here are loaded
 tabs = [ # Track a running Bitcoin node
-         #Bitcoind({"host": "http://127.0.0.1:8332",
-         #          "username": "bitcoinrpc",
-         #          # Read the password from a file
-         #          "password": "password" }),
+         #("Bitcoind", {"host": "http://127.0.0.1:8332",
+         #              "username": "bitcoinrpc",
+         #              # Read the password from a file
+         #              "password": "password" }),
         
          # A Bitcoin price ticker
-         #BitcoinPrice(),
+         #"BitcoinPrice",
          
          # Displays CPU, RAM usage and uptime
-         SystemStats(),
+         # "history_minutes" sets how many minutes of usage are summarized (default 10)
+         ("SystemStats", {"history_minutes": 10}),
          
          # Displays disk usage
-         DiskUsage(),
+         # Mounts that don't respond within "timeout" seconds (default 2) are shown as stale
+         "DiskUsage",
          
          # Tracks website uptime
-         WebsiteUptime({"websites": [ {"name": "Google",
-                                       "url": "http://google.com"} ] })]
\ No newline at end of file
+         # Up to "concurrency" websites (default 8) are checked at once, each check
+         # may take "timeout" seconds (default 5) and all checks "round_timeout" seconds (default 10)
+         # "probe" sets how websites are checked, and can also be set for a single website:
+         #   "head" sends a HEAD request (default), "range" requests only the first byte,
+         #   "get" requests the whole page and "tcp" only connects
+         # Addresses are looked up again every "dns_ttl" seconds (default 300)
+         # Once the 99th percentile response time of a website reaches "slow_threshold"
+         # seconds (default 1), "UP" is shown in yellow, and once its median response
+         # time does, the website is shown as SLOW
+         ("WebsiteUptime", {"websites": [ {"name": "Google",
+                                           "url": "http://google.com"} ] })]
\ No newline at end of file
@@ -1,15 +1,21 @@
 import time
-import subprocess
 import atexit
 import os
 import sys
 
-from PIL import Image
+from contextlib import contextmanager
 
-from utils import split_string_into_chunks
+from framebuffer import FrameBuffer
+from pacing import Pacer, PROFILES
+from transport import SerialTransport, encode_text
+from writer import SerialWriter
+from metrics import registry
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
 
+FRAME_WAIT_SECONDS = registry.histogram("showtime_frame_queue_wait_seconds",
+                                        "Time spent waiting for room in the output queue at the end of a frame")
+
 class Screen(object):
     FOREGROUND = 3
     BACKGROUND = 4
@@ -28,13 +34,35 @@ class Screen(object):
     
     WIDTH = 320
     HEIGHT = 240
+    
+    # RGB565 values for the colors above
+    PALETTE = [ 0x0000, 0xF800, 0x07E0, 0xFFE0, 0x001F, 0xF81F, 0x07FF, 0xFFFF ]
+
+class FrameStats:
+    """
+    Describes how much was queued to be sent to the screen during a frame
+    """
+    def __init__(self, byte_count, emit_time, wait_time):
+        self.byte_count = byte_count
+        
+        # Time spent queuing the frame at the end of it and how much of it
+        # was spent waiting for room in the queue
+        self.emit_time = emit_time
+        self.wait_time = wait_time
 
 class ScreenContext:
-    def __init__(self, port_name):
+    def __init__(self, port_name, use_framebuffer=True, pacing_profile=PROFILES["link"], pixel_mode=False):
         self.port_name = port_name
-        self.port = None
+        self.transport = SerialTransport(port_name)
+        
+        # Decides how fast the buffer can be pushed to the screen
+        self.pacer = Pacer(pacing_profile)
+        
+        # Sends the pushed buffer on its own thread
+        self.writer = None
         
-        self.buffer = unicode("")
+        # Encoded command bytes waiting to be pushed to the screen
+        self.buffer = ""
         
         # Current text size
         self.text_size = 2
@@ -44,8 +72,42 @@ class ScreenContext:
         self.current_fg_color = Screen.WHITE
         self.current_bg_color = Screen.BLACK
         
+        # Colors the screen is known to use, None if unknown
+        self.sent_fg_color = None
+        self.sent_bg_color = None
+        
         self.characters_on_line = 0
         
+        # Commands are only pushed to the screen at the end of a frame
+        # while one is open
+        self.frame_depth = 0
+        self.frame_start_bytes = 0
+        self.frame_start_wait_time = 0.0
+        self.last_frame_stats = None
+        
+        # If the frame buffer is used, text drawn at its text size is only
+        # sent to the screen on present() and only where it has changed
+        self.framebuffer = None
+        
+        # In pixel mode, everything is drawn on a pixel buffer instead, and only
+        # the rectangles that have changed are sent as images
+        self.pixel_mode = pixel_mode
+        
+        if pixel_mode:
+            # Imported here, as pixel mode requires numpy
+            from pixelbuffer import PixelBuffer
+            
+            width, height = self.get_resolution()
+            self.framebuffer = PixelBuffer(width, height, self.text_size)
+        elif use_framebuffer:
+            self.framebuffer = FrameBuffer(self.get_columns(), self.get_rows(), self.text_size)
+            
+        # The row from which text was drawn directly using another text size
+        self.passthrough_start_row = None
+        
+        # Within a frame, where the commands drawing text of another size start in the buffer
+        self.passthrough_start = None
+        
         self.open_port()
     
     def reset_screen(self):
@@ -60,6 +122,14 @@ class ScreenContext:
         """
         Erase specified amount of rows starting from a specified row
         """
+        if self.pixel_mode:
+            width, height = self.get_resolution()
+            row_height = self.text_size * 8
+            
+            self.framebuffer.fill_rect(0, start * row_height, width, rows * row_height, self.current_bg_color)
+            self.framebuffer.move_cursor(0, start + rows)
+            return
+        
         self.home()
         
         for i in range(0, start):
@@ -73,42 +143,201 @@ class ScreenContext:
                 
             self.write(empty_line)
     
+    def erase_tab_area(self):
+        """
+        Erase everything below the two header rows
+        """
+        if self.framebuffer is not None:
+            # Only the cells that aren't already empty will be erased
+            self.erase_rows(2, self.get_rows()-2)
+        else:
+            # Make the erasing maneuver a bit faster by temporarily changing
+            # the font size to 4
+            self.set_text_size(4)
+            self.erase_rows(1, self.get_rows()-1)
+            self.set_text_size(2)
+            
+        return self
+    
     def open_port(self):
         """
-        Opens the serial port for writing
+        Opens the serial port for writing and sets the terminal attributes
+        necessary to input commands correctly
         """
-        self.port = open(self.port_name, "w")
+        self.transport.open()
         
-        # Run the port_open executable, which sets attributes necessary
-        # to input commands correctly
-        try:
-            subprocess.call([ "./port_open", self.port_name ])
-        except OSError as e:
-            print "Couldn't execute the port_open executable to set terminal parameters!"
-            
-            raise e
+        self.writer = SerialWriter(self.transport, self.pacer).start()
+    
+    def wait_until_ready(self, timeout=6):
+        """
+        Wait for the screen to boot up if opening the port reset it, for at most
+        timeout seconds. Nothing should be sent to the screen before it's ready
+        """
+        self.transport.wait_until_ready(timeout)
+        
+        return self
     
     def cleanup(self):
         """
-        Closes the serial port
+        Resets the screen and closes the serial port
         """
-        self.buffer = unicode("\ec\e[2s\e[1r\r")
-        self.sleep(0.1)
+        self.buffer = "\x1bc\x1b[2s\x1b[1r\r"
+        self.push_to_serial()
         
-        self.port.close()
+        # The writer thread is waited for, so that it isn't still running when the process exits
+        self.writer.drain(1)
+        self.writer.stop(1)
+        self.close()
         
-    def push_to_serial(self):
+    def close(self):
         """
-        Uploads the current content of the buffer into the screen
+        Closes the serial port without waiting for anything queued to be sent
         """
-        list = [ "echo", "-ne"]
+        if self.writer is not None:
+            self.writer.stop()
+            
+        self.transport.close()
         
-        list.append(self.buffer)
-        subprocess.call(list, stdout=self.port)
+    def push_to_serial(self):
+        """
+        Queues the current content of the buffer to be sent to the screen
+        """
+        if self.buffer:
+            self.writer.put(self.buffer)
+            
         self.buffer = ""
         
+        # Text of another size that has been pushed can't be left out anymore
+        self.passthrough_start = None
+        
+        return self
+    
+    def drain(self, timeout=None):
+        """
+        Waits until everything pushed has been sent to the screen
+        """
+        self.push_to_serial()
+        self.writer.drain(timeout)
+        
+        return self
+    
+    def begin_frame(self):
+        """
+        Start a frame. Until the frame is ended, commands are collected into the buffer
+        instead of being sent one by one. Frames can be nested, in which case everything
+        is sent when the outermost frame ends
+        """
+        if self.frame_depth == 0:
+            self.frame_start_bytes = self.writer.bytes_queued + len(self.buffer)
+            self.frame_start_wait_time = self.writer.time_blocked
+            
+        self.frame_depth += 1
+        
+        return self
+    
+    def end_frame(self):
+        """
+        End a frame, queuing everything drawn during it. Returns a FrameStats object
+        describing the frame if the outermost frame was ended, None otherwise
+        """
+        self.frame_depth -= 1
+        
+        if self.frame_depth > 0:
+            return None
+        
+        start_time = time.time()
+        start_bytes = self.frame_start_bytes
+        start_wait_time = self.frame_start_wait_time
+        
+        self.present()
+        
+        self.last_frame_stats = FrameStats(self.writer.bytes_queued - start_bytes,
+                                           time.time() - start_time,
+                                           self.writer.time_blocked - start_wait_time)
+        
+        stats = self.last_frame_stats
+        
+        FRAME_WAIT_SECONDS.observe(stats.wait_time)
+        
+        return stats
+    
+    @contextmanager
+    def frame(self):
+        """
+        Context manager that draws everything inside it as a single frame
+        """
+        self.begin_frame()
+        
+        try:
+            yield self
+        finally:
+            self.end_frame()
+    
+    def send_colors(self, fg_color, bg_color):
+        """
+        Sends commands for the provided colors, unless the screen
+        is already using them. None leaves a color as is
+        """
+        if bg_color is not None and bg_color != self.sent_bg_color:
+            self.buffer += "\x1b[%s%sm" % (str(Screen.BACKGROUND), str(bg_color))
+            self.sent_bg_color = bg_color
+            self.flush()
+            
+        if fg_color is not None and fg_color != self.sent_fg_color:
+            self.buffer += "\x1b[%s%sm" % (str(Screen.FOREGROUND), str(fg_color))
+            self.sent_fg_color = fg_color
+            self.flush()
+            
+        return self
+    
+    def is_buffered(self):
+        """
+        Returns True if drawing is currently done on the frame buffer
+        """
+        return self.framebuffer is not None and self.text_size == self.framebuffer.text_size
+    
+    def present(self):
+        """
+        Sends the cells, or pixels in pixel mode, that have changed since the last frame to the screen
+        """
+        if not self.is_buffered():
+            return self.push_to_serial()
+        
+        # Collect the changes into the buffer without pushing each command separately
+        self.begin_frame()
+        
+        if self.pixel_mode:
+            for x, y, width, height, data in self.framebuffer.get_changed_rects():
+                self.buffer += "\x1b[%d;%d,%d;%di" % (x, y, width+x, height+y)
+                self.buffer += data
+        else:
+            for x, y, cells in self.framebuffer.get_changed_runs():
+                self.buffer += "\x1b[%s;%sH" % (str(x), str(y))
+                
+                for char, fg_color, bg_color in cells:
+                    # Spaces don't have a foreground color, so keep the current one
+                    self.send_colors(fg_color, bg_color)
+                    self.buffer += char
+                
+        self.framebuffer.commit()
+        
+        # Push everything at once unless we're inside a frame already
+        self.frame_depth -= 1
+        
+        if self.frame_depth == 0:
+            self.push_to_serial()
+        
         return self
     
+    def get_resolution(self):
+        """
+        Returns the (width, height) of the screen in pixels, depending on the orientation
+        """
+        if self.orientation == Screen.HORIZONTAL:
+            return Screen.WIDTH, Screen.HEIGHT
+        else:
+            return Screen.HEIGHT, Screen.WIDTH
+    
     def get_columns(self):
         """
         Returns the amount of columns, depending on the current text size
@@ -134,10 +363,10 @@ class ScreenContext:
         """
         self.current_fg_color = color
         
-        self.buffer += "\e[%s%sm" % (str(Screen.FOREGROUND), str(color))
-        self.sleep()
+        if self.is_buffered():
+            return self
         
-        return self
+        return self.send_colors(color, None)
     
     def bg_color(self, color):
         """
@@ -145,43 +374,54 @@ class ScreenContext:
         """
         self.current_bg_color = color
         
-        self.buffer += "\e[%s%sm" % (str(Screen.BACKGROUND), str(color))
-        self.sleep()
+        if self.is_buffered():
+            return self
         
-        return self
+        return self.send_colors(None, color)
     
     def linebreak(self):
         """
         Moves cursor to the beginning of the next line
         """
-        self.buffer += r'\n\r'
-        
         self.characters_on_line = 0
         
-        self.sleep()
+        if self.is_buffered():
+            self.framebuffer.linebreak()
+            return self
+        
+        self.buffer += "\n\r"
+        
+        self.flush()
         
         return self
     
     def write(self, text, split=True):
         """
-        Prints provided text to screen
+        Prints provided text to screen. split is no longer needed, as
+        text is always sent in bursts the screen can keep up with
         """
+        text = encode_text(text)
+        
         self.characters_on_line += len(text)
         if (self.characters_on_line >= self.get_columns()):
             self.characters_on_line = self.characters_on_line % self.get_columns()
-        
-        # If the text is longer than 25 characters or so
-        # sending it all at once will cause artifacts as
-        # the serial port can't keep up
-        # Split the string into chunks to prevent this
-        if split:
-            text_chunks = split_string_into_chunks(text, 25)
             
-            for chunk in text_chunks:
-                self.buffer += chunk
-                self.sleep(len(chunk) * 0.0045)
+        if self.is_buffered():
+            self.framebuffer.put_text(text, self.current_fg_color, self.current_bg_color)
         else:
-            self.sleep(len(chunk) * 0.0045)
+            self.send_text(text)
+            
+        return self
+    
+    def send_text(self, text):
+        """
+        Sends text to the screen
+        """
+        if not text:
+            return self
+        
+        self.buffer += text
+        self.flush(0)
             
         return self
     
@@ -209,8 +449,13 @@ class ScreenContext:
         """
         Reset the LCD screen
         """
-        self.buffer += "\ec"
-        self.sleep()
+        self.buffer += "\x1bc"
+        self.sent_fg_color = None
+        self.sent_bg_color = None
+        self.flush()
+        
+        if self.framebuffer is not None:
+            self.framebuffer.clear(None, Screen.BLACK)
         
         return self
     
@@ -218,11 +463,24 @@ class ScreenContext:
         """
         Move cursor to home, eg. 0x0
         """
-        self.buffer += "\e[H"
-        self.sleep(0.1)
+        if self.is_buffered():
+            self.framebuffer.move_cursor(0, 0)
+            self.characters_on_line = 0
+            return self
+        
+        if self.passthrough_start_row is not None:
+            self.passthrough_start_row = 0
+            
+            # The text no longer covers only the rows from where it started
+            self.passthrough_start = None
+        
+        self.buffer += "\x1b[H"
+        self.flush(self.pacer.profile.home_delay)
         self.characters_on_line = 0
         
         # Colors have to be set again after going home otherwise glitches occur
+        self.sent_fg_color = None
+        self.sent_bg_color = None
         self.bg_color(self.current_bg_color).fg_color(self.current_fg_color)
         
         return self
@@ -231,8 +489,11 @@ class ScreenContext:
         """
         Erase everything drawn on the screen
         """
-        self.buffer += "\e[2J"
-        self.sleep()
+        self.buffer += "\x1b[2J"
+        self.flush()
+        
+        if self.framebuffer is not None:
+            self.framebuffer.clear(None, Screen.BLACK)
         
         return self
     
@@ -240,9 +501,78 @@ class ScreenContext:
         """
         Set text size. Font width is set to 6*size and font height to 8*size
         """
-        self.buffer += "\e[%ss" % str(size)
+        if self.pixel_mode:
+            # Text of any size is drawn on the pixel buffer
+            self.framebuffer.text_size = size
+            self.text_size = size
+            return self
+        
+        if self.framebuffer is not None and size != self.text_size:
+            if self.is_buffered():
+                # Text of another size is drawn directly starting from the current cursor
+                # position, so send everything drawn so far and move the cursor there
+                self.present()
+                
+                self.passthrough_start_row = self.framebuffer.cursor_y
+                
+                # Past the end of a row the screen wraps before drawing, leaving the row as it is
+                if self.framebuffer.cursor_x >= self.framebuffer.columns:
+                    self.passthrough_start_row += 1
+                
+                if self.frame_depth > 0:
+                    # Collect the commands, so that they can be left out if the screen already shows
+                    # the same. The colors are always sent, so the commands don't depend on earlier ones
+                    self.passthrough_start = len(self.buffer)
+                    self.sent_fg_color = None
+                    self.sent_bg_color = None
+                    
+                self.buffer += "\x1b[%s;%sH" % (str(self.framebuffer.cursor_x), str(self.framebuffer.cursor_y))
+                self.flush()
+            elif size == self.framebuffer.text_size:
+                self.buffer += "\x1b[%ss" % str(size)
+                self.text_size = size
+                self.end_passthrough()
+                self.flush()
+                
+                return self
+        elif self.is_buffered():
+            return self
+        
+        self.buffer += "\x1b[%ss" % str(size)
         self.text_size = size
-        self.sleep()
+        self.flush()
+        
+        if self.passthrough_start_row is not None:
+            self.send_colors(self.current_fg_color, self.current_bg_color)
+        
+        return self
+    
+    def end_passthrough(self):
+        """
+        Go back to drawing on the frame buffer after drawing text of another size directly.
+        The text is left out if the same was drawn at the same position last time and
+        nothing has been drawn over it since
+        """
+        start = self.passthrough_start
+        
+        if start is not None:
+            data = self.buffer[start:]
+            
+            if self.framebuffer.is_span_shown(self.passthrough_start_row, data):
+                self.buffer = self.buffer[:start]
+                
+                # The colors the screen uses are the ones before the text was left out
+                self.sent_fg_color = None
+                self.sent_bg_color = None
+                
+        # The frame buffer no longer knows what the rows drawn over contain
+        self.framebuffer.invalidate(self.passthrough_start_row)
+        
+        if start is not None:
+            self.framebuffer.add_span(self.passthrough_start_row, data)
+            
+        self.passthrough_start_row = None
+        self.passthrough_start = None
         
         return self
     
@@ -252,14 +582,20 @@ class ScreenContext:
         Accepts values between 0-3, where 1 stands for clockwise 90 degree rotation,
         2 for 180 degree rotation, etc.
         """
-        self.buffer += "\e[%sr" % str(rotation)
+        self.buffer += "\x1b[%sr" % str(rotation)
         
         if rotation % 2 == 0:
             self.orientation = Screen.VERTICAL
         else:
             self.orientation = Screen.HORIZONTAL
             
-        self.sleep()
+        self.flush()
+        
+        if self.pixel_mode:
+            width, height = self.get_resolution()
+            self.framebuffer.resize(width, height)
+        elif self.framebuffer is not None:
+            self.framebuffer.resize(self.get_columns(), self.get_rows())
         
         return self
     
@@ -267,47 +603,116 @@ class ScreenContext:
         """
         Set cursor position
         """
-        self.buffer += "\e[%s;%sH" % (str(x), str(y))
+        if self.is_buffered():
+            self.framebuffer.move_cursor(x, y)
+            self.characters_on_line = x
+            return self
+        
+        self.buffer += "\x1b[%s;%sH" % (str(x), str(y))
         
-        self.sleep()
+        self.flush()
         
         return self
     
-    def draw_image(self, img_path, x, y):
+    def draw_image(self, img_path, x, y, size=None):
         """
-        Draw image at the specified position
-        THIS METHOD ISN'T RELIABLE
+        Draw image at the specified position, optionally resizing it to
+        the provided (width, height). Converted images are cached, so the
+        same image can be drawn on every frame
         """
-        # Convert the image
-        subprocess.call([ "ffmpeg", "-y", "-loglevel", "8","-i", img_path, "-vcodec",
-                          "rawvideo", "-f", "rawvideo", "-pix_fmt", "rgb565", "temp.raw" ])
+        # Imported here, as loading the imaging libraries is slow and most tabs don't draw images
+        import imaging
         
-        image = Image.open(img_path)
+        width, height, data = imaging.load_image(img_path, size)
         
-        width = image.size[0]
-        height = image.size[1]
+        return self.draw_pixels(data, x, y, width, height)
+    
+    def draw_pixels(self, data, x, y, width, height):
+        """
+        Draw little-endian RGB565 pixel data at the specified position
+        """
+        if self.pixel_mode:
+            # Only the pixels that have changed are sent when the frame ends
+            self.framebuffer.put_pixels(data, x, y, width, height)
+            return self
         
-        self.write("\e[%d;%d,%d;%di" % (x, y, width+x, height+y))
+        # Anything drawn on the frame buffer has to be sent before the image
+        self.present()
         
-        self.sleep(0.05)
-        # Call a script to cat the image data to the serial port,
-        # perhaps we could handle this in Python somehow?
-        subprocess.call([ "./display_image.sh" ])
-        self.sleep(0.05)
+        self.buffer += "\x1b[%d;%d,%d;%di" % (x, y, width+x, height+y)
+        self.flush()
+        
+        self.buffer += data
+        self.flush()
         
         # Add a linebreak to prevent glitches when printing text again
-        self.linebreak()
+        self.buffer += "\n\r"
+        self.flush()
+        
+        if self.framebuffer is not None:
+            row_height = self.framebuffer.text_size * 8
+            self.framebuffer.invalidate(y / row_height, (y + height - 1) / row_height + 1)
+        
+        return self
+    
+    def draw_pixels_inline(self, data, width, height):
+        """
+        Draw little-endian RGB565 pixel data at the cursor in pixel mode, as if it
+        were text taking up the rows it covers. The cursor is moved to the end of
+        the pixel data on the last of those rows
+        """
+        char_width = self.text_size * 6
+        row_height = self.text_size * 8
+        
+        # Wrap to the next line if the pixel data doesn't fit on this one
+        if self.framebuffer.cursor_x > 0 and self.framebuffer.cursor_x + width > self.framebuffer.width:
+            self.framebuffer.linebreak()
+            
+        x = self.framebuffer.cursor_x
+        y = self.framebuffer.cursor_y
+        
+        self.draw_pixels(data, x, y, width, height)
+        
+        self.framebuffer.cursor_x = x + width
+        self.framebuffer.cursor_y = y + (max(height, 1) - 1) / row_height * row_height
+        
+        self.characters_on_line = (x + width) / char_width % self.get_columns()
+        
+        return self
+    
+    def flush(self, delay=None):
+        """
+        Pushes the buffer to the screen followed by the command delay
+        of the pacing profile, or the specified delay. Inside a frame
+        this does nothing, as the buffer is pushed when the frame ends
+        """
+        if self.frame_depth > 0:
+            return self
+        
+        self.push_to_serial()
+        
+        if delay is None:
+            delay = self.pacer.profile.command_delay
+            
+        if delay > 0:
+            self.writer.put_delay(delay)
         
         return self
     
     def sleep(self, period=0.001, push_to_serial=True):
         """
-        Sleeps for a defined period of time. If push_to_serial is True (default), commands
-        and text in the buffer will be pushed to the screen
+        Waits for a defined period of time before sending anything more to the screen.
+        If push_to_serial is True (default), commands and text in the buffer will be
+        pushed to the screen first. The wait is queued on the writer thread, so this
+        returns right away. Inside a frame this does nothing, like flush
         """
+        if self.frame_depth > 0:
+            return self
+        
         if push_to_serial:
             self.push_to_serial()
-        
-        time.sleep(period)
+            
+        if period > 0:
+            self.writer.put_delay(period)
         
         return self
@@ -0,0 +1,255 @@
+from context import ScreenContext
+from pacing import PROFILES
+from header import Header
+from metrics import registry
+from scheduler import Scheduler, RenderBudget
+
+import threading
+import time
+import traceback
+
+FRAME_SECONDS = registry.histogram("showtime_frame_seconds", "Time taken to draw a frame and queue it to be sent",
+                                   label_names=("port", "tab"))
+REDRAWS_DEFERRED = registry.counter("showtime_redraws_deferred_total",
+                                    "Redraws put off to keep within the render budget", label_names=("port",))
+
+class Display:
+    """
+    Rotates the tabs on a single screen on its own thread, so that a slow
+    or unplugged screen doesn't hold up the others. The tabs can be shared
+    between displays, as drawing only reads the snapshots of their collectors
+    """
+    # How long to wait before opening the port again after the port or drawing has failed
+    RETRY_DELAY = 5
+    
+    # How long to wait at exit for the frame being drawn to be finished
+    STOP_TIMEOUT = 5
+    
+    # Events that are drawn right away, regardless of the render budget
+    CRITICAL_EVENTS = set([ "rotate", "clock" ])
+    
+    def __init__(self, port_name, tabs, tab_change_interval=15, start_tab=0,
+                 use_framebuffer=True, pacing_profile=PROFILES["link"], boot_wait=6, pixel_mode=False,
+                 render_budget=0.5):
+        self.port_name = port_name
+        self.tabs = tabs
+        self.tab_change_interval = tab_change_interval
+        self.current_tab = start_tab % len(tabs)
+        
+        self.use_framebuffer = use_framebuffer
+        self.pacing_profile = pacing_profile
+        self.pixel_mode = pixel_mode
+        
+        # How long the screen may take to boot up after opening the port has reset it
+        self.boot_wait = boot_wait
+        
+        self.header = Header()
+        
+        # Frames are only drawn when a timer fires or the current tab's data changes
+        self.scheduler = Scheduler()
+        
+        # Redraws for changed data and refreshes may take up at most this fraction of the time
+        self.budget = RenderBudget(render_budget)
+        
+        for tab in tabs:
+            for collector in tab.get_collectors():
+                collector.add_listener(self.on_collector_run)
+                
+        self.ctx = None
+        self.thread = None
+        
+        # Set at exit, after which no more frames are started
+        self.stopped = threading.Event()
+    
+    def start(self):
+        """
+        Start drawing on a daemon thread
+        """
+        self.thread = threading.Thread(target=self.run, name="display-%s" % self.port_name)
+        self.thread.daemon = True
+        self.thread.start()
+        
+        return self
+    
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.ctx = ScreenContext(self.port_name, use_framebuffer=self.use_framebuffer,
+                                         pacing_profile=self.pacing_profile, pixel_mode=self.pixel_mode)
+                
+                # Wait for the screen to boot up before we start uploading anything
+                self.ctx.wait_until_ready(self.boot_wait).reset_lcd().set_rotation(0)
+                
+                print "Started on %s" % self.port_name
+                
+                self.rotate_tabs()
+            except Exception as e:
+                # The port may have been closed while stopping
+                if self.stopped.is_set():
+                    return
+                
+                print "Display on %s failed: %s, retrying in %d seconds" % (self.port_name, e, self.RETRY_DELAY)
+                
+                # Anything but the port failing is a bug, show where it happened
+                if not isinstance(e, (IOError, OSError)):
+                    traceback.print_exc()
+                
+                if self.ctx is not None:
+                    self.ctx.close()
+                    self.ctx = None
+                
+                self.stopped.wait(self.RETRY_DELAY)
+    
+    def on_collector_run(self, collector):
+        """
+        Draw the current tab again if the collector belongs to it
+        """
+        if collector in self.tabs[self.current_tab].get_collectors():
+            self.scheduler.invalidate("data")
+            
+    def schedule_rotation(self):
+        if len(self.tabs) > 1:
+            self.scheduler.schedule("rotate", time.time() + self.tab_change_interval)
+            
+    def schedule_refresh(self):
+        """
+        Schedule drawing the current tab again if it has to be refreshed periodically
+        """
+        refresh_interval = self.tabs[self.current_tab].get_refresh_interval()
+        
+        if refresh_interval is not None:
+            self.scheduler.schedule("refresh", time.time() + refresh_interval)
+        else:
+            self.scheduler.cancel("refresh")
+            
+    def schedule_clock(self):
+        """
+        Schedule drawing the header again when the shown minute changes
+        """
+        current_time = time.time()
+        
+        self.scheduler.schedule("clock", current_time - current_time % 60 + 60)
+        
+    def get_redraw_time(self):
+        """
+        Returns when the current tab can be drawn again without going over the render
+        budget. If the redraw wouldn't be done before a time critical one is due,
+        it's left for that one
+        """
+        tab = self.tabs[self.current_tab]
+        
+        redraw_time = max(self.budget.next_time, time.time())
+        redraw_end_time = redraw_time + self.budget.get_cost(self.current_tab, tab.get_render_cost())
+        
+        for name in self.CRITICAL_EVENTS:
+            deadline = self.scheduler.get_deadline(name)
+            
+            if deadline is not None and deadline < redraw_end_time:
+                redraw_time = max(redraw_time, deadline)
+                
+        return redraw_time
+    
+    def draw_frame(self, erase=False):
+        """
+        Draw the header and the current tab, erasing the previous tab first if erase is True
+        """
+        tab = self.tabs[self.current_tab]
+        frame_start_time = time.time()
+        
+        # Everything drawn during the frame is sent at once when it ends. The previous
+        # tab is erased in the same frame, so that with a frame buffer only what
+        # differs between the tabs is sent
+        with self.ctx.frame():
+            if erase:
+                self.ctx.erase_tab_area()
+                
+            self.header.render_header(self.ctx, self.current_tab, tab.title, len(self.tabs))
+            tab.render_tab(self.ctx)
+            
+        frame_time = time.time() - frame_start_time
+        
+        FRAME_SECONDS.observe(frame_time, self.port_name, tab.title)
+        
+        # The frame is sent in the background, so the time sending it takes is estimated from its size
+        send_time = self.ctx.last_frame_stats.byte_count / self.pacing_profile.bytes_per_second
+        
+        self.budget.record(self.current_tab, frame_start_time, frame_time + send_time)
+        
+        # Any redraw put off until now has been drawn
+        self.scheduler.cancel("budget")
+    
+    def rotate_tabs(self):
+        self.schedule_rotation()
+        self.schedule_refresh()
+        self.schedule_clock()
+        
+        self.draw_frame()
+        
+        while True:
+            # Sleep until something has to be drawn again
+            events = self.scheduler.wait()
+            
+            if self.stopped.is_set():
+                return
+            
+            erase = False
+            
+            if "rotate" in events:
+                self.current_tab = (self.current_tab + 1) % len(self.tabs)
+                erase = True
+                
+                self.schedule_rotation()
+                self.schedule_refresh()
+            elif "refresh" in events:
+                self.schedule_refresh()
+                
+            if "clock" in events:
+                self.schedule_clock()
+                
+            # Redraws for changed data and refreshes wait until they fit in the budget,
+            # and whatever else happens meanwhile is drawn along with them
+            if not events & self.CRITICAL_EVENTS:
+                redraw_time = self.get_redraw_time()
+                
+                if redraw_time > time.time():
+                    self.scheduler.schedule("budget", redraw_time)
+                    REDRAWS_DEFERRED.inc(1, self.port_name)
+                    continue
+                
+            self.draw_frame(erase)
+    
+    def stop(self):
+        """
+        Stop drawing once the current frame has been drawn, and wait for that
+        for at most STOP_TIMEOUT seconds. Returns True if the thread has stopped
+        """
+        self.stopped.set()
+        self.scheduler.invalidate("stop")
+        
+        if self.thread is not None:
+            self.thread.join(self.STOP_TIMEOUT)
+            
+            return not self.thread.is_alive()
+        
+        return True
+    
+    def cleanup(self):
+        """
+        Stop drawing, then reset the screen and close the port if it's open
+        """
+        stopped = self.stop()
+        
+        ctx = self.ctx
+        
+        if ctx is None:
+            return
+        
+        # A frame may still be being sent, resetting the screen now could leave part of it shown
+        if not stopped:
+            ctx.close()
+            return
+        
+        try:
+            ctx.cleanup()
+        except (IOError, OSError):
+            ctx.close()
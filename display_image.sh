@@ -1,2 +0,0 @@
-#!/bin/bash
-cat temp.raw > /dev/ttyUSB0
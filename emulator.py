@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+"""
+Emulates an ODROID-SHOW on a pseudo-terminal, so that SHOWtime can be run
+and measured without the device. Run this and pass the printed port to
+showtime.py using --port
+"""
+from array import array
+from collections import Counter
+
+import os
+import sys
+import tty
+import time
+import errno
+import threading
+import argparse
+
+from context import Screen
+from transport import configure_port
+
+class EmulatedScreen:
+    """
+    A model of the screen that interprets the commands ScreenContext sends.
+    Pixels are kept as RGB565 values, and the characters drawn are kept
+    by their pixel position so that the text on the screen can be read back
+    """
+    COLORS = Screen.PALETTE
+    
+    # Estimated time the device spends on each pixel it draws, on each command
+    # and on each byte it receives at 500000 baud
+    PIXEL_TIME = 0.000002
+    COMMAND_TIME = 0.00005
+    BYTE_TIME = 10.0 / 500000
+    
+    def __init__(self):
+        self.bytes_received = 0
+        self.command_counts = Counter()
+        self.processing_time = 0.0
+        
+        self.state = "text"
+        self.params = ""
+        self.image = None
+        
+        self.reset()
+        
+        # Don't count the initial state
+        self.processing_time = 0.0
+    
+    def reset(self):
+        self.rotation = 1
+        self.text_size = 2
+        self.fg_color = Screen.WHITE
+        self.bg_color = Screen.BLACK
+        
+        self.cursor_x = 0
+        self.cursor_y = 0
+        
+        self.clear()
+    
+    def get_size(self):
+        """
+        Returns the (width, height) of the screen in its current rotation
+        """
+        if self.rotation % 2 == 0:
+            return Screen.HEIGHT, Screen.WIDTH
+        else:
+            return Screen.WIDTH, Screen.HEIGHT
+    
+    def clear(self):
+        self.pixels = array("H", [ self.COLORS[Screen.BLACK] ]) * (Screen.WIDTH * Screen.HEIGHT)
+        self.characters = {}
+        
+        self.processing_time += Screen.WIDTH * Screen.HEIGHT * self.PIXEL_TIME
+    
+    def fill_rect(self, x, y, width, height, color):
+        screen_width, screen_height = self.get_size()
+        
+        for row in range(max(y, 0), min(y + height, screen_height)):
+            start = row * screen_width + max(x, 0)
+            end = row * screen_width + min(x + width, screen_width)
+            
+            if end > start:
+                self.pixels[start:end] = array("H", [ color ]) * (end - start)
+        
+        self.processing_time += width * height * self.PIXEL_TIME
+    
+    def feed(self, data):
+        """
+        Interpret the bytes received from the serial port
+        """
+        self.bytes_received += len(data)
+        self.processing_time += len(data) * self.BYTE_TIME
+        
+        i = 0
+        
+        while i < len(data):
+            if self.state == "image":
+                # Pixel data is consumed in bulk
+                count = min(len(data) - i, self.image["remaining"])
+                self.put_image_data(data[i:i+count])
+                i += count
+                continue
+            
+            char = data[i]
+            i += 1
+            
+            if self.state == "text":
+                if char == "\x1b":
+                    self.state = "escape"
+                else:
+                    self.put_char(char)
+            elif self.state == "escape":
+                if char == "[":
+                    self.state = "csi"
+                    self.params = ""
+                else:
+                    if char == "c":
+                        self.count_command("reset")
+                        self.reset()
+                    
+                    self.state = "text"
+            elif self.state == "csi":
+                if char.isdigit() or char in ";,":
+                    self.params += char
+                else:
+                    self.state = "text"
+                    self.run_command(char, self.params)
+    
+    def count_command(self, name):
+        self.command_counts[name] += 1
+        self.processing_time += self.COMMAND_TIME
+    
+    def run_command(self, command, params):
+        values = [ int(value) for value in params.replace(",", ";").split(";") if value ]
+        
+        if command == "H":
+            self.count_command("cursor")
+            
+            if len(values) >= 2:
+                self.cursor_x = values[0] * self.text_size * 6
+                self.cursor_y = values[1] * self.text_size * 8
+            else:
+                self.cursor_x = 0
+                self.cursor_y = 0
+        elif command == "J":
+            self.count_command("erase")
+            self.clear()
+        elif command == "s":
+            self.count_command("text_size")
+            self.text_size = values[0] if values else 2
+        elif command == "r":
+            self.count_command("rotation")
+            self.rotation = values[0] if values else 0
+        elif command == "m":
+            self.count_command("color")
+            
+            for value in values:
+                if 30 <= value <= 37:
+                    self.fg_color = value - 30
+                elif 40 <= value <= 47:
+                    self.bg_color = value - 40
+        elif command == "i" and len(values) == 4:
+            self.count_command("image")
+            
+            x1, y1, x2, y2 = values
+            width = max(x2 - x1, 0)
+            height = max(y2 - y1, 0)
+            
+            self.image = {"x": x1, "y": y1, "width": width, "height": height,
+                          "offset": 0, "remaining": width * height * 2, "partial": ""}
+            
+            if self.image["remaining"] > 0:
+                self.state = "image"
+        else:
+            self.count_command("unknown")
+    
+    def put_image_data(self, data):
+        image = self.image
+        screen_width, screen_height = self.get_size()
+        
+        image["remaining"] -= len(data)
+        
+        # A pixel may be split between two reads
+        data = image["partial"] + data
+        usable = len(data) - len(data) % 2
+        image["partial"] = data[usable:]
+        
+        values = array("H", data[:usable])
+        if sys.byteorder == "big":
+            values.byteswap()
+        
+        for value in values:
+            x = image["x"] + image["offset"] % image["width"]
+            y = image["y"] + image["offset"] / image["width"]
+            
+            if 0 <= x < screen_width and 0 <= y < screen_height:
+                self.pixels[y * screen_width + x] = value
+            
+            image["offset"] += 1
+        
+        self.processing_time += len(values) * self.PIXEL_TIME
+        
+        if image["remaining"] <= 0:
+            self.state = "text"
+    
+    def put_char(self, char):
+        screen_width, screen_height = self.get_size()
+        char_width = self.text_size * 6
+        char_height = self.text_size * 8
+        
+        if char == "\n":
+            self.count_command("newline")
+            self.cursor_y += char_height
+            return
+        elif char == "\r":
+            self.cursor_x = 0
+            return
+        
+        self.command_counts["characters"] += 1
+        
+        # Wrap to the next line if the character doesn't fit on this one
+        if self.cursor_x + char_width > screen_width:
+            self.cursor_x = 0
+            self.cursor_y += char_height
+        
+        self.fill_rect(self.cursor_x, self.cursor_y, char_width, char_height, self.COLORS[self.bg_color])
+        
+        if char != " ":
+            # Draw the character as a block of its foreground color, leaving a gap
+            # on the right and at the bottom like the font does
+            self.fill_rect(self.cursor_x, self.cursor_y, char_width - self.text_size,
+                           char_height - self.text_size, self.COLORS[self.fg_color])
+        
+        # Characters drawn over are replaced
+        for position in self.characters.keys():
+            x, y = position
+            if x < self.cursor_x + char_width and self.cursor_x < x + self.characters[position][1] * 6 and \
+               y < self.cursor_y + char_height and self.cursor_y < y + self.characters[position][1] * 8:
+                del self.characters[position]
+        
+        self.characters[(self.cursor_x, self.cursor_y)] = (char, self.text_size)
+        
+        self.cursor_x += char_width
+    
+    def get_text(self):
+        """
+        Returns the text on the screen as lines of characters, using
+        the current text size to place them
+        """
+        screen_width, screen_height = self.get_size()
+        char_width = self.text_size * 6
+        char_height = self.text_size * 8
+        
+        lines = [ [ " " ] * (screen_width / char_width) for i in range(0, screen_height / char_height) ]
+        
+        for (x, y), (char, size) in self.characters.items():
+            row = y / char_height
+            column = x / char_width
+            
+            if row < len(lines) and column < len(lines[row]):
+                lines[row][column] = char
+        
+        return [ "".join(line) for line in lines ]
+    
+    def get_stats(self):
+        return {"bytes_received": self.bytes_received,
+                "command_counts": dict(self.command_counts),
+                "processing_time": self.processing_time}
+
+class Emulator:
+    """
+    Runs an EmulatedScreen behind a pseudo-terminal. port_name can be
+    used like the device node of a real ODROID-SHOW
+    """
+    def __init__(self):
+        self.screen = EmulatedScreen()
+        self.lock = threading.Lock()
+        
+        self.master, self.slave = os.openpty()
+        self.port_name = os.ttyname(self.slave)
+        
+        # Pass bytes through unchanged. The slave is kept open so that
+        # the pseudo-terminal survives clients opening and closing it
+        tty.setraw(self.slave)
+        
+        # The emulated screen doesn't boot up, so configure the port
+        # like a screen that is already running
+        configure_port(self.slave)
+        
+        self.thread = None
+    
+    def start(self):
+        self.thread = threading.Thread(target=self.read_port, name="emulator")
+        self.thread.daemon = True
+        self.thread.start()
+        
+        return self
+    
+    def read_port(self):
+        while True:
+            try:
+                data = os.read(self.master, 65536)
+            except OSError as e:
+                if e.errno in (errno.EINTR, errno.EAGAIN):
+                    continue
+                elif e.errno == errno.EIO:
+                    # Raised while no client has the port open
+                    time.sleep(0.01)
+                    continue
+                
+                raise
+            
+            with self.lock:
+                self.screen.feed(data)
+    
+    def get_stats(self):
+        with self.lock:
+            return self.screen.get_stats()
+    
+    def get_text(self):
+        with self.lock:
+            return self.screen.get_text()
+
+def print_stats(stats):
+    print "%d bytes received, estimated processing time %.3f s" % (stats["bytes_received"],
+                                                                  stats["processing_time"])
+    print "Commands: %s" % ", ".join([ "%s=%d" % (name, count) for name, count in
+                                        sorted(stats["command_counts"].items()) ])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--interval", "-i", help="how often to print statistics in seconds (default=5)",
+                        type=float, default=5)
+    parser.add_argument("--text", help="print the text on the screen along with the statistics",
+                        action="store_true")
+    args = parser.parse_args()
+    
+    emulator = Emulator().start()
+    
+    print "Emulating ODROID-SHOW on %s" % emulator.port_name
+    sys.stdout.flush()
+    
+    try:
+        while True:
+            time.sleep(args.interval)
+            
+            print_stats(emulator.get_stats())
+            
+            if args.text:
+                print "\n".join(emulator.get_text())
+            
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        print_stats(emulator.get_stats())
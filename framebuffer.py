@@ -0,0 +1,167 @@
+# Marks a cell whose content is unknown, eg. because it was drawn using
+# a different text size. Such cells are only redrawn once something is
+# written on them again
+FOREIGN = None
+
+# Unchanged cells between two changed runs are resent instead of moving
+# the cursor if the gap is at most this long, as a cursor move costs
+# about as many bytes
+MAX_GAP = 4
+
+class FrameBuffer:
+    """
+    A character cell model of the screen. Drawing is done on the back buffer,
+    which is then compared against the front buffer (what the screen is known to show)
+    so that only changed runs of cells need to be sent
+    """
+    def __init__(self, columns, rows, text_size):
+        self.text_size = text_size
+        
+        # The commands last used to draw text directly using another text size,
+        # by the first row the text covers. It's taken to cover the rest of the rows
+        self.spans = {}
+        
+        self.cursor_x = 0
+        self.cursor_y = 0
+        
+        self.resize(columns, rows)
+    
+    def resize(self, columns, rows):
+        """
+        Resize the buffers, discarding their contents
+        """
+        self.columns = columns
+        self.rows = rows
+        
+        self.back = self.create_grid(FOREIGN)
+        self.front = self.create_grid(FOREIGN)
+        self.spans = {}
+        
+        self.cursor_x = 0
+        self.cursor_y = 0
+    
+    def create_grid(self, cell):
+        return [ [ cell ] * self.columns for i in range(0, self.rows) ]
+    
+    def clear(self, fg_color, bg_color):
+        """
+        Mark both buffers as blank, eg. after the screen has been erased
+        """
+        blank = (" ", fg_color, bg_color)
+        
+        self.back = self.create_grid(blank)
+        self.front = self.create_grid(blank)
+        self.spans = {}
+    
+    def invalidate(self, start_row=0, end_row=None):
+        """
+        Forget the contents of rows starting from the specified row, as they
+        have been drawn over without the frame buffer
+        """
+        if end_row is None:
+            end_row = self.rows
+        
+        for y in range(max(start_row, 0), min(end_row, self.rows)):
+            self.back[y] = [ FOREIGN ] * self.columns
+            self.front[y] = [ FOREIGN ] * self.columns
+        
+        # Spans reaching the rows may have been drawn over
+        for y in self.spans.keys():
+            if y < end_row:
+                del self.spans[y]
+    
+    def add_span(self, start_row, data):
+        """
+        Remember the commands used to draw text of another size over the rows
+        from start_row on, which should have been invalidated
+        """
+        self.spans[start_row] = data
+    
+    def is_span_shown(self, start_row, data):
+        """
+        Returns True if the same commands were last used to draw over the rows
+        from start_row on, and nothing has been drawn over them since
+        """
+        if self.spans.get(start_row) != data:
+            return False
+        
+        return all([ cell is FOREIGN for row in self.front[start_row:] for cell in row ])
+    
+    def move_cursor(self, x, y):
+        self.cursor_x = x
+        self.cursor_y = y
+    
+    def linebreak(self):
+        self.cursor_x = 0
+        self.cursor_y += 1
+    
+    def put_text(self, text, fg_color, bg_color):
+        """
+        Put text on the back buffer at the cursor, wrapping it
+        the same way the screen does
+        """
+        for char in text:
+            if self.cursor_x >= self.columns:
+                self.linebreak()
+            
+            if self.cursor_y >= self.rows:
+                # Text that falls off the bottom of the screen isn't shown
+                return
+            
+            if char == " ":
+                # The foreground color of a space doesn't affect how it looks
+                self.back[self.cursor_y][self.cursor_x] = (char, None, bg_color)
+            else:
+                self.back[self.cursor_y][self.cursor_x] = (char, fg_color, bg_color)
+            self.cursor_x += 1
+    
+    def get_changed_runs(self):
+        """
+        Returns a list of (x, y, cells) tuples for every run of cells
+        that differs between the back and front buffers
+        """
+        runs = []
+        
+        for y in range(0, self.rows):
+            back_row = self.back[y]
+            front_row = self.front[y]
+            
+            if back_row == front_row:
+                continue
+            
+            start = None
+            end = None
+            
+            for x in range(0, self.columns):
+                cell = back_row[x]
+                
+                if cell is FOREIGN:
+                    # The run can't be continued over cells with unknown content
+                    if start is not None:
+                        runs.append((start, y, back_row[start:end]))
+                        start = None
+                    
+                    continue
+                
+                if cell == front_row[x]:
+                    continue
+                
+                if start is not None and x - end > MAX_GAP:
+                    runs.append((start, y, back_row[start:end]))
+                    start = None
+                
+                if start is None:
+                    start = x
+                
+                end = x + 1
+            
+            if start is not None:
+                runs.append((start, y, back_row[start:end]))
+        
+        return runs
+    
+    def commit(self):
+        """
+        Mark the back buffer as shown on the screen
+        """
+        self.front = [ list(row) for row in self.back ]
@@ -0,0 +1,40 @@
+import os
+
+import numpy
+from PIL import Image
+
+from utils import LRUCache
+
+# Converted images by (path, modification time, size)
+image_cache = LRUCache(16)
+
+def convert_to_rgb565(image):
+    """
+    Convert a PIL image into little-endian RGB565 pixel data
+    """
+    pixels = numpy.asarray(image.convert("RGB"), dtype=numpy.uint16)
+    
+    rgb565 = ((pixels[:, :, 0] >> 3) << 11) | ((pixels[:, :, 1] >> 2) << 5) | (pixels[:, :, 2] >> 3)
+    
+    return rgb565.astype("<u2").tobytes()
+
+def load_image(img_path, size=None):
+    """
+    Load an image, resized to the provided (width, height) if any, and
+    return a (width, height, RGB565 data) tuple. Converted images are cached
+    until the file is modified
+    """
+    key = (img_path, os.path.getmtime(img_path), size)
+    
+    converted = image_cache.get(key)
+    
+    if converted is None:
+        image = Image.open(img_path)
+        
+        if size is not None and image.size != size:
+            image = image.convert("RGB").resize(size, Image.ANTIALIAS)
+        
+        converted = (image.size[0], image.size[1], convert_to_rgb565(image))
+        image_cache.put(key, converted)
+    
+    return converted
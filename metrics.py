@@ -0,0 +1,211 @@
+"""
+Counters and histograms describing how SHOWtime is running, exposed
+in the Prometheus text format over HTTP or by rewriting a file
+"""
+from bisect import bisect_left
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+import os
+import threading
+import time
+
+# Bucket upper bounds in seconds
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Bucket upper bounds in bytes per second
+THROUGHPUT_BUCKETS = (1000, 2500, 5000, 10000, 20000, 30000, 40000, 50000)
+
+def format_labels(label_names, label_values, extra=""):
+    labels = [ '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n"))
+               for name, value in zip(label_names, label_values) ]
+    
+    if extra:
+        labels.append(extra)
+    
+    if not labels:
+        return ""
+    
+    return "{%s}" % ",".join(labels)
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    
+    return repr(float(value))
+
+class Counter:
+    """
+    A value that only increases, kept separately for each combination of label values
+    """
+    def __init__(self, name, help, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        
+        self.values = {}
+        self.lock = threading.Lock()
+    
+    def inc(self, amount=1, *label_values):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+    
+    def render(self):
+        lines = [ "# HELP %s %s" % (self.name, self.help),
+                  "# TYPE %s counter" % self.name ]
+        
+        with self.lock:
+            values = sorted(self.values.items())
+        
+        for label_values, value in values:
+            lines.append("%s%s %s" % (self.name, format_labels(self.label_names, label_values),
+                                      format_value(value)))
+        
+        return lines
+
+class Histogram:
+    """
+    Counts observed values into buckets. Only the bucket counts, the sum and the
+    count are stored, so observing a value takes constant time and memory
+    """
+    def __init__(self, name, help, buckets=TIME_BUCKETS, label_names=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.label_names = label_names
+        
+        # [ bucket counts, sum, count ] for each combination of label values
+        self.values = {}
+        self.lock = threading.Lock()
+    
+    def observe(self, value, *label_values):
+        i = bisect_left(self.buckets, value)
+        
+        with self.lock:
+            entry = self.values.get(label_values)
+            
+            if entry is None:
+                entry = self.values[label_values] = [ [ 0 ] * len(self.buckets), 0.0, 0 ]
+            
+            entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+    
+    def render(self):
+        lines = [ "# HELP %s %s" % (self.name, self.help),
+                  "# TYPE %s histogram" % self.name ]
+        
+        with self.lock:
+            values = sorted([ (label_values, (list(counts), total, count))
+                              for label_values, (counts, total, count) in self.values.items() ])
+        
+        for label_values, (counts, total, count) in values:
+            # Buckets are cumulative in the exposition format
+            cumulative = 0
+            
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                
+                lines.append("%s_bucket%s %d" % (self.name,
+                                                 format_labels(self.label_names, label_values,
+                                                               'le="%s"' % format_value(bound)),
+                                                 cumulative))
+            
+            lines.append("%s_sum%s %s" % (self.name, format_labels(self.label_names, label_values),
+                                          format_value(total)))
+            lines.append("%s_count%s %d" % (self.name, format_labels(self.label_names, label_values), count))
+        
+        return lines
+
+class Registry:
+    """
+    Holds the metrics so that they can be rendered together
+    """
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+    
+    def add(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        
+        return metric
+    
+    def counter(self, name, help, label_names=()):
+        return self.add(Counter(name, help, label_names))
+    
+    def histogram(self, name, help, buckets=TIME_BUCKETS, label_names=()):
+        return self.add(Histogram(name, help, buckets, label_names))
+    
+    def render(self):
+        """
+        Returns the metrics in the Prometheus text format
+        """
+        with self.lock:
+            metrics = list(self.metrics)
+        
+        lines = []
+        
+        for metric in metrics:
+            lines += metric.render()
+        
+        return "\n".join(lines) + "\n"
+
+# The registry the rest of SHOWtime records its metrics in
+registry = Registry()
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = self.server.registry.render()
+        
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+def start_thread(target, name):
+    thread = threading.Thread(target=target, name=name)
+    thread.daemon = True
+    thread.start()
+
+def serve_metrics(port, address="127.0.0.1", registry=registry):
+    """
+    Serve the metrics over HTTP on a background thread. Only local
+    connections are accepted unless another address is provided
+    """
+    server = HTTPServer((address, port), MetricsHandler)
+    server.registry = registry
+    
+    start_thread(server.serve_forever, "metrics-server")
+    
+    return server
+
+def write_metrics(path, registry=registry):
+    """
+    Replace the file with the current metrics. The file is replaced
+    atomically, so readers never see a partially written file
+    """
+    temp_path = "%s.tmp" % path
+    
+    with open(temp_path, "w") as metrics_file:
+        metrics_file.write(registry.render())
+    
+    os.rename(temp_path, path)
+
+def write_metrics_periodically(path, interval=10, registry=registry):
+    """
+    Rewrite the metrics file every interval seconds on a background thread
+    """
+    def write_loop():
+        while True:
+            try:
+                write_metrics(path, registry)
+            except (IOError, OSError) as e:
+                print "Couldn't write metrics to %s: %s" % (path, e)
+            
+            time.sleep(interval)
+    
+    start_thread(write_loop, "metrics-writer")
@@ -0,0 +1,87 @@
+import time
+
+from metrics import registry
+
+WAIT_SECONDS = registry.counter("showtime_pacer_wait_seconds_total",
+                                "Time spent waiting so that the screen can keep up")
+
+# The serial port settings SerialTransport sets
+BAUD_RATE = 500000
+BITS_PER_BYTE = 10 # 8 data bits, a start bit and a stop bit
+
+# The size of the screen's serial input buffer in bytes
+INPUT_BUFFER_SIZE = 64
+
+class PacingProfile:
+    """
+    Describes how fast bytes can be sent to the screen. Up to burst_size bytes
+    can be sent at once, after which bytes are released at bytes_per_second
+    """
+    def __init__(self, bytes_per_second, burst_size, command_delay=0.0, home_delay=0.0):
+        self.bytes_per_second = float(bytes_per_second)
+        self.burst_size = burst_size
+        
+        # Additional time to wait after each command and after moving the cursor home
+        self.command_delay = command_delay
+        self.home_delay = home_delay
+    
+    @staticmethod
+    def from_baud_rate(baud_rate, buffer_size):
+        """
+        Create a profile that sends bytes as fast as the serial link allows
+        without overflowing the screen's input buffer
+        """
+        return PacingProfile(float(baud_rate) / BITS_PER_BYTE, buffer_size)
+
+PROFILES = {
+    # Send as fast as the link allows
+    "link": PacingProfile.from_baud_rate(BAUD_RATE, INPUT_BUFFER_SIZE),
+    
+    # The fixed delays SHOWtime has traditionally used: 4.5 ms per character
+    # in chunks of 25 characters, 1 ms after each command and 100 ms after going home
+    "conservative": PacingProfile(1 / 0.0045, 25, command_delay=0.001, home_delay=0.1)
+}
+
+class Pacer:
+    """
+    A token bucket that delays writes only when the byte budget
+    of the profile has been exhausted
+    """
+    def __init__(self, profile):
+        self.profile = profile
+        
+        self.tokens = float(profile.burst_size)
+        self.last_refill = time.time()
+        
+        # Total time spent waiting
+        self.time_waited = 0.0
+    
+    def refill(self):
+        current_time = time.time()
+        
+        self.tokens = min(float(self.profile.burst_size),
+                          self.tokens + (current_time - self.last_refill) * self.profile.bytes_per_second)
+        self.last_refill = current_time
+    
+    def consume(self, count):
+        """
+        Wait until the specified amount of bytes can be sent.
+        count shouldn't be larger than the profile's burst size
+        """
+        self.refill()
+        
+        if self.tokens < count:
+            self.wait((count - self.tokens) / self.profile.bytes_per_second)
+            self.refill()
+        
+        self.tokens -= count
+    
+    def wait(self, period):
+        """
+        Wait for a fixed period of time
+        """
+        if period > 0:
+            time.sleep(period)
+            self.time_waited += period
+            
+            WAIT_SECONDS.inc(period)
@@ -0,0 +1,194 @@
+"""
+A pixel model of the screen for pixel mode, in which text and images are drawn
+in memory and only the rectangles that have changed are sent as image data
+"""
+import numpy
+
+from context import Screen
+from glyphs import atlas
+
+# Marks a pixel whose color is unknown, eg. after the screen has been rotated.
+# Such pixels are only sent once something is drawn on them
+UNKNOWN = 0x10000
+
+# Changes are looked for in bands of this many rows, and each band is sent
+# as one rectangle for each group of changed columns
+BAND_HEIGHT = 8
+
+# Sending a rectangle costs about this many bytes besides its pixel data
+RECT_OVERHEAD = 24
+
+# Unchanged columns between two changed ones are resent instead of starting
+# a new rectangle if there are at most this many of them
+MAX_GAP = 2
+
+class PixelBuffer:
+    """
+    Text and images are drawn on the back buffer, which is compared against
+    the front buffer (what the screen is known to show) so that only rectangles
+    containing changed pixels need to be sent. Pixels are kept as RGB565 values
+    """
+    def __init__(self, width, height, text_size):
+        self.text_size = text_size
+        
+        self.width = 0
+        self.height = 0
+        
+        self.back = None
+        self.front = None
+        
+        self.resize(width, height)
+    
+    def resize(self, width, height):
+        """
+        Resize the buffers. A screen filled with a single color looks the same
+        afterwards, otherwise the contents are discarded
+        """
+        color = UNKNOWN
+        
+        if self.front is not None and (self.front == self.front[0, 0]).all():
+            color = self.front[0, 0]
+        
+        self.width = width
+        self.height = height
+        
+        self.back = numpy.empty((height, width), dtype=numpy.uint32)
+        self.back.fill(color)
+        self.front = self.back.copy()
+        
+        self.cursor_x = 0
+        self.cursor_y = 0
+    
+    def clear(self, fg_color, bg_color):
+        """
+        Mark both buffers as filled with the background color, eg. after the screen has been erased
+        """
+        self.back.fill(Screen.PALETTE[bg_color])
+        self.front.fill(Screen.PALETTE[bg_color])
+    
+    def move_cursor(self, x, y):
+        """
+        Move the cursor to the character cell at the current text size
+        """
+        self.cursor_x = x * 6 * self.text_size
+        self.cursor_y = y * 8 * self.text_size
+    
+    def linebreak(self):
+        self.cursor_x = 0
+        self.cursor_y += 8 * self.text_size
+    
+    def put_text(self, text, fg_color, bg_color):
+        """
+        Draw text on the back buffer at the cursor, wrapping it
+        the same way the screen does
+        """
+        char_width = 6 * self.text_size
+        char_height = 8 * self.text_size
+        
+        while text:
+            if self.cursor_x + char_width > self.width:
+                self.linebreak()
+            
+            if self.cursor_y + char_height > self.height:
+                # Text that falls off the bottom of the screen isn't shown
+                return
+            
+            # Draw as much as fits on the current line at once
+            count = min(len(text), (self.width - self.cursor_x) / char_width)
+            
+            self.back[self.cursor_y:self.cursor_y+char_height,
+                      self.cursor_x:self.cursor_x+count*char_width] = \
+                atlas.render(text[:count], self.text_size,
+                             Screen.PALETTE[fg_color], Screen.PALETTE[bg_color])
+            
+            self.cursor_x += count * char_width
+            text = text[count:]
+    
+    def fill_rect(self, x, y, width, height, color):
+        """
+        Fill a rectangle on the back buffer with one of the colors defined in Screen
+        """
+        self.back[max(y, 0):max(y + height, 0), max(x, 0):max(x + width, 0)] = Screen.PALETTE[color]
+    
+    def put_pixels(self, data, x, y, width, height):
+        """
+        Draw little-endian RGB565 pixel data on the back buffer, clipped to the screen
+        """
+        pixels = numpy.frombuffer(data, dtype="<u2").reshape(height, width)
+        
+        # Clip the part outside the screen
+        left = max(-x, 0)
+        top = max(-y, 0)
+        right = min(width, self.width - x)
+        bottom = min(height, self.height - y)
+        
+        if right <= left or bottom <= top:
+            return
+        
+        self.back[y+top:y+bottom, x+left:x+right] = pixels[top:bottom, left:right]
+    
+    def get_changed_rects(self):
+        """
+        Returns a list of (x, y, width, height, data) tuples covering every pixel that
+        differs between the back and front buffers, where data is little-endian RGB565
+        """
+        changed = (self.back != self.front) & (self.back != UNKNOWN)
+        
+        rects = []
+        
+        for band_y in range(0, self.height, BAND_HEIGHT):
+            band = changed[band_y:band_y+BAND_HEIGHT]
+            columns = numpy.flatnonzero(band.any(axis=0))
+            
+            if len(columns) == 0:
+                continue
+            
+            # Split the changed columns into groups wherever the gap is too wide
+            breaks = numpy.flatnonzero(numpy.diff(columns) > MAX_GAP + 1)
+            starts = columns[numpy.concatenate(([ 0 ], breaks + 1))]
+            ends = columns[numpy.concatenate((breaks, [ len(columns) - 1 ]))] + 1
+            
+            for x1, x2 in zip(starts, ends):
+                rows = numpy.flatnonzero(band[:, x1:x2].any(axis=1))
+                
+                self.add_rect(rects, (int(x1), band_y + int(rows[0]), int(x2), band_y + int(rows[-1]) + 1))
+        
+        return [ (x1, y1, x2 - x1, y2 - y1, self.encode_rect(x1, y1, x2, y2)) for x1, y1, x2, y2 in rects ]
+    
+    def add_rect(self, rects, rect):
+        """
+        Add the (x1, y1, x2, y2) rectangle to the list, merging it with a rectangle
+        of the band above it if sending both as one costs fewer bytes
+        """
+        x1, y1, x2, y2 = rect
+        
+        for i in range(len(rects) - 1, -1, -1):
+            other_x1, other_y1, other_x2, other_y2 = rects[i]
+            
+            if other_y2 < y1 - BAND_HEIGHT:
+                break
+            
+            merged = (min(x1, other_x1), min(y1, other_y1), max(x2, other_x2), max(y2, other_y2))
+            
+            separate_cost = 2 * ((x2 - x1) * (y2 - y1) + (other_x2 - other_x1) * (other_y2 - other_y1)) + RECT_OVERHEAD
+            merged_cost = 2 * (merged[2] - merged[0]) * (merged[3] - merged[1])
+            
+            if merged_cost <= separate_cost:
+                rects[i] = merged
+                return
+        
+        rects.append(rect)
+    
+    def encode_rect(self, x1, y1, x2, y2):
+        pixels = self.back[y1:y2, x1:x2]
+        
+        # Unknown pixels that are sent along with changed ones are drawn black
+        pixels[pixels == UNKNOWN] = Screen.PALETTE[Screen.BLACK]
+        
+        return pixels.astype("<u2").tobytes()
+    
+    def commit(self):
+        """
+        Mark the back buffer as shown on the screen
+        """
+        self.front = self.back.copy()
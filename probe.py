@@ -0,0 +1,173 @@
+"""
+Cheap ways of checking whether a website is up, which resolve addresses
+using a DNS cache and measure how long the website took to respond
+"""
+import httplib
+import socket
+import ssl
+import threading
+import time
+import urlparse
+
+# The HTTP request sent in each probe mode, None if the mode only connects
+PROBE_MODES = {"head": ("HEAD", {}),
+               "range": ("GET", {"Range": "bytes=0-0"}),
+               "get": ("GET", {}),
+               "tcp": None}
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+class ProbeError(Exception):
+    """
+    The website responded with an error
+    """
+    pass
+
+class DNSCache:
+    """
+    Keeps resolved addresses for ttl seconds. The resolver doesn't tell the TTLs
+    of the DNS records, so a fixed TTL is used. Failed lookups aren't cached
+    """
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        
+        # ([ (family, address), ... ], expiry time) by (host, port)
+        self.entries = {}
+        self.lock = threading.Lock()
+        
+        # Amount of lookups that weren't answered from the cache
+        self.lookup_count = 0
+    
+    def resolve(self, host, port):
+        """
+        Returns a list of (family, address) tuples for connecting to the host,
+        in the order the resolver prefers them
+        """
+        current_time = time.time()
+        
+        with self.lock:
+            entry = self.entries.get((host, port))
+        
+        if entry is not None and entry[1] > current_time:
+            return entry[0]
+        
+        addresses = [ (family, address) for family, socktype, proto, canonname, address in
+                      socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM) ]
+        
+        with self.lock:
+            self.entries[(host, port)] = (addresses, current_time + self.ttl)
+            self.lookup_count += 1
+        
+        return addresses
+    
+    def forget(self, host, port):
+        """
+        Resolve the host again on the next lookup, eg. after its address couldn't be connected to
+        """
+        with self.lock:
+            self.entries.pop((host, port), None)
+    
+    def connect(self, host, port, timeout):
+        """
+        Returns a socket connected to the host, trying each of its addresses
+        in turn like socket.create_connection does
+        """
+        error = None
+        
+        for family, address in self.resolve(host, port):
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.settimeout(timeout)
+            
+            try:
+                sock.connect(address)
+            except socket.error as e:
+                sock.close()
+                error = e
+            else:
+                return sock
+        
+        # None of the addresses could be connected to, they may have changed
+        self.forget(host, port)
+        
+        raise error
+
+class CachedHTTPConnection(httplib.HTTPConnection):
+    """
+    An HTTP connection that resolves the host using a DNSCache
+    """
+    def __init__(self, host, port, timeout, dns_cache):
+        httplib.HTTPConnection.__init__(self, host, port, timeout=timeout)
+        
+        self.dns_cache = dns_cache
+    
+    def connect(self):
+        self.sock = self.dns_cache.connect(self.host, self.port, self.timeout)
+
+class CachedHTTPSConnection(httplib.HTTPSConnection):
+    """
+    An HTTPS connection that resolves the host using a DNSCache. The certificate
+    is verified against the host name like urllib2 does
+    """
+    def __init__(self, host, port, timeout, dns_cache):
+        self.ssl_context = ssl.create_default_context()
+        
+        httplib.HTTPSConnection.__init__(self, host, port, timeout=timeout, context=self.ssl_context)
+        
+        self.dns_cache = dns_cache
+    
+    def connect(self):
+        sock = self.dns_cache.connect(self.host, self.port, self.timeout)
+        
+        self.sock = self.ssl_context.wrap_socket(sock, server_hostname=self.host)
+
+def probe(url, mode, timeout, dns_cache):
+    """
+    Check the website using one of PROBE_MODES and return how long it took to respond
+    in seconds, not counting resolving its address. Raises an exception if it's down.
+    HTTP probes only wait for the response headers, and redirects aren't followed,
+    as a redirect already shows that the website responds
+    """
+    parsed_url = urlparse.urlparse(url)
+    
+    host = parsed_url.hostname
+    port = parsed_url.port or DEFAULT_PORTS.get(parsed_url.scheme, 80)
+    
+    if host is None:
+        raise ValueError("No host in %s" % url)
+    
+    # Resolve the address before timing the probe
+    dns_cache.resolve(host, port)
+    
+    start_time = time.time()
+    
+    if PROBE_MODES[mode] is None:
+        dns_cache.connect(host, port, timeout).close()
+        
+        return time.time() - start_time
+    
+    method, headers = PROBE_MODES[mode]
+    
+    if parsed_url.scheme == "https":
+        connection = CachedHTTPSConnection(host, port, timeout, dns_cache)
+    else:
+        connection = CachedHTTPConnection(host, port, timeout, dns_cache)
+    
+    path = parsed_url.path or "/"
+    
+    if parsed_url.query:
+        path += "?" + parsed_url.query
+    
+    try:
+        connection.request(method, path, headers=headers)
+        response = connection.getresponse()
+        
+        latency = time.time() - start_time
+    finally:
+        # The body isn't read, closing the connection stops it from being downloaded
+        connection.close()
+    
+    # A website that doesn't allow HEAD requests still responded
+    if response.status >= 400 and not (method == "HEAD" and response.status in (405, 501)):
+        raise ProbeError("HTTP %d %s" % (response.status, response.reason))
+    
+    return latency
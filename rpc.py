@@ -0,0 +1,128 @@
+import base64
+import httplib
+import json
+import socket
+import urlparse
+
+# JSON-RPC error code for methods the server doesn't have
+METHOD_NOT_FOUND = -32601
+
+class RPCError(Exception):
+    """
+    An error returned by the JSON-RPC server for a single call
+    """
+    def __init__(self, code, message):
+        Exception.__init__(self, "%s (code %s)" % (message, code))
+        
+        self.code = code
+        self.message = message
+
+class JsonRpcClient:
+    """
+    A JSON-RPC client that sends calls as batches over a persistent
+    keep-alive HTTP connection
+    """
+    def __init__(self, url, username=None, password=None, timeout=4):
+        parsed_url = urlparse.urlparse(url)
+        
+        self.host = parsed_url.hostname
+        self.port = parsed_url.port
+        self.path = parsed_url.path or "/"
+        self.timeout = timeout
+        
+        self.headers = {"Content-Type": "application/json",
+                        "Connection": "keep-alive"}
+        
+        if username is not None:
+            credentials = base64.b64encode("%s:%s" % (username, password))
+            self.headers["Authorization"] = "Basic %s" % credentials
+        
+        self.connection = None
+        
+        # Amount of HTTP requests sent and connections opened
+        self.request_count = 0
+        self.connection_count = 0
+    
+    def batch(self, calls):
+        """
+        Sends the provided (method, params) calls in a single request. Returns a list
+        containing a (result, error) tuple for each call, so that one failing call
+        doesn't prevent using the results of the others
+        """
+        request = [ {"jsonrpc": "1.0", "id": i, "method": method, "params": list(params)}
+                    for i, (method, params) in enumerate(calls) ]
+        
+        response = self.post(json.dumps(request))
+        
+        if not isinstance(response, list):
+            # The whole batch was rejected
+            error = response.get("error") or {}
+            error = RPCError(error.get("code"), error.get("message", "Invalid response"))
+            
+            return [ (None, error) ] * len(calls)
+        
+        results = [ (None, RPCError(None, "No response")) ] * len(calls)
+        
+        for entry in response:
+            i = entry.get("id")
+            
+            if not isinstance(i, int) or i < 0 or i >= len(calls):
+                continue
+            
+            if entry.get("error") is not None:
+                results[i] = (None, RPCError(entry["error"].get("code"), entry["error"].get("message")))
+            else:
+                results[i] = (entry.get("result"), None)
+        
+        return results
+    
+    def call(self, method, *params):
+        """
+        Sends a single call, raising RPCError if it fails
+        """
+        result, error = self.batch([ (method, params) ])[0]
+        
+        if error is not None:
+            raise error
+        
+        return result
+    
+    def post(self, body):
+        """
+        Posts the body and returns the decoded response. A request on a reused
+        connection is retried once on a new connection, as the server may have
+        closed the old one
+        """
+        for attempt in range(0, 2):
+            reused = self.connection is not None
+            
+            if not reused:
+                self.connection = httplib.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                self.connection_count += 1
+            
+            try:
+                self.request_count += 1
+                self.connection.request("POST", self.path, body, self.headers)
+                
+                response = self.connection.getresponse()
+                data = response.read()
+            except (httplib.HTTPException, socket.error) as e:
+                self.close()
+                
+                if reused and not isinstance(e, socket.timeout):
+                    continue
+                
+                raise
+            
+            if response.getheader("connection", "").lower() == "close":
+                self.close()
+            
+            try:
+                return json.loads(data)
+            except ValueError:
+                raise RPCError(response.status, "Invalid response: %s" % response.reason)
+    
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
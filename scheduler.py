@@ -0,0 +1,110 @@
+import threading
+import time
+
+class Scheduler:
+    """
+    Waits until the next named timer is due or something is invalidated
+    from another thread, whichever happens first
+    """
+    def __init__(self):
+        # Deadlines by timer name
+        self.deadlines = {}
+        
+        # Names invalidated since the last wait
+        self.invalidated = set()
+        
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+    
+    def schedule(self, name, deadline):
+        """
+        Set the timer to fire at the deadline, replacing an earlier deadline
+        """
+        with self.lock:
+            self.deadlines[name] = deadline
+        
+        self.wakeup.set()
+    
+    def cancel(self, name):
+        with self.lock:
+            self.deadlines.pop(name, None)
+    
+    def get_deadline(self, name):
+        """
+        Returns the deadline of the timer, None if it isn't scheduled
+        """
+        with self.lock:
+            return self.deadlines.get(name)
+    
+    def invalidate(self, name):
+        """
+        Make the current or next wait return right away. Can be called from any thread
+        """
+        with self.lock:
+            self.invalidated.add(name)
+        
+        self.wakeup.set()
+    
+    def wait(self):
+        """
+        Sleep until at least one timer is due or something has been invalidated,
+        and return the set of their names. Timers that fired are removed
+        """
+        while True:
+            self.wakeup.clear()
+            
+            current_time = time.time()
+            
+            with self.lock:
+                due = set([ name for name, deadline in self.deadlines.items() if deadline <= current_time ])
+                
+                for name in due:
+                    del self.deadlines[name]
+                
+                due |= self.invalidated
+                self.invalidated = set()
+                
+                timeout = None
+                if self.deadlines:
+                    timeout = min(self.deadlines.values()) - current_time
+            
+            if due:
+                return due
+            
+            self.wakeup.wait(timeout)
+
+class RenderBudget:
+    """
+    Keeps redraws that aren't time critical within a fraction of the time, by
+    leaving cost / fraction seconds between the start of a redraw and the next one.
+    The cost of a redraw is the time taken to draw it plus the time taken to send
+    it, and is also estimated for each key from its earlier redraws
+    """
+    # Weight of the latest redraw in the estimated cost
+    SMOOTHING = 0.3
+    
+    def __init__(self, fraction=0.5):
+        self.fraction = fraction
+        
+        # Estimated cost of a redraw by key
+        self.costs = {}
+        
+        # The earliest time the next redraw fits in the budget
+        self.next_time = 0.0
+    
+    def get_cost(self, key, default):
+        """
+        Returns the estimated cost of redrawing the key, or default if it hasn't been redrawn
+        """
+        return self.costs.get(key, default)
+    
+    def record(self, key, start_time, cost):
+        """
+        Record the cost of a redraw that started at start_time
+        """
+        if key in self.costs:
+            self.costs[key] += self.SMOOTHING * (cost - self.costs[key])
+        else:
+            self.costs[key] = cost
+            
+        self.next_time = start_time + cost / self.fraction
@@ -1,67 +1,111 @@
 #!/usr/bin/env python
 
-from context import Screen, ScreenContext
+from pacing import PROFILES
+from collector import CollectorPool
+from display import Display
+from tabs import create_tabs, format_import_times
+from state import StateStore, track_tabs
+import metrics
 import config
 
-# Import tabs here
-from tabs.bitcoin import Bitcoind, BitcoinPrice
-from tabs.sysinfo import SystemStats, DiskUsage
-
-from header import Header
-
 import atexit
 import time
 import sys
 import argparse
 
 parser = argparse.ArgumentParser()
-parser.add_argument("--tab", "-t", help="start from which tab (default=1)",
-                    type=int, default=1)
+parser.add_argument("--tab", "-t", help="start from which tab (default=1), can be given for each port",
+                    type=int, action="append")
 parser.add_argument("--time", "-T", 
-                    help="for how many seconds should a tab be shown before changing it (default=15)",
-                    type=int, default=15)
+                    help="for how many seconds should a tab be shown before changing it (default=15), can be given for each port",
+                    type=int, action="append")
 parser.add_argument("--port", "-p",
-                    help="serial port to use as the output (default=/dev/ttyUSB0)",
-                    type=str, default="/dev/ttyUSB0")
+                    help="serial port to use as the output (default=/dev/ttyUSB0), can be given several times to use several screens",
+                    type=str, action="append")
+parser.add_argument("--no-framebuffer",
+                    help="redraw everything on every frame instead of only the changed parts",
+                    action="store_true")
+parser.add_argument("--pixel-mode",
+                    help="draw everything in memory and send only the pixels that have changed as images, requires numpy",
+                    action="store_true")
+parser.add_argument("--pacing",
+                    help="how fast data is sent to the screen, 'link' sends as fast as the serial link allows and 'conservative' uses fixed delays (default=link)",
+                    choices=sorted(PROFILES.keys()), default="link")
+parser.add_argument("--render-budget",
+                    help="fraction of the time redraws for changed data may take up, so that the clock and tab changes stay on time (default=0.5)",
+                    type=float, default=0.5)
+parser.add_argument("--boot-wait",
+                    help="how many seconds to wait at most for the screen to boot up when opening the port resets it (default=6)",
+                    type=float, default=6)
+parser.add_argument("--state-file",
+                    help="keep the state of the tabs in this file, so that it's restored after restarting",
+                    type=str, default=None)
+parser.add_argument("--state-interval",
+                    help="how often to write the state file in seconds (default=300)",
+                    type=int, default=300)
+parser.add_argument("--metrics-port",
+                    help="serve metrics in the Prometheus text format on this local port",
+                    type=int, default=None)
+parser.add_argument("--metrics-file",
+                    help="write metrics in the Prometheus text format to this file every 10 seconds",
+                    type=str, default=None)
 args = parser.parse_args()
 
-# Apply the arguments
-default_tab = args.tab - 1
-tab_change_interval = args.time
-
-tabs = config.tabs
-current_tab = default_tab
+# Redraws can't take up no time at all, and a budget that is negative or above 1 would never put them off
+if not 0 < args.render_budget <= 1:
+    parser.error("--render-budget must be more than 0 and at most 1")
 
-ctx = ScreenContext(args.port)
+# Apply the arguments. --tab and --time apply to the port given in the same position,
+# and the last ones given apply to the rest of the ports
+ports = args.port or [ "/dev/ttyUSB0" ]
+start_tabs = args.tab or [ 1 ]
+tab_change_intervals = args.time or [ 15 ]
 
-atexit.register(ctx.cleanup)
+# The modules of the configured tabs are imported here
+tabs = create_tabs(config.tabs)
 
-# Wait 6 seconds for the screen to boot up before we start uploading anything
-ctx.sleep(6).reset_lcd().set_rotation(0)
+print "Imported modules for the tabs:"
+print format_import_times()
 
-# Header
-header = Header()
+# Restore the state of the tabs before their collectors start
+if args.state_file is not None:
+    state_store = StateStore(args.state_file).load()
+    track_tabs(state_store, tabs)
+    
+    state_store.start(args.state_interval)
+    atexit.register(state_store.flush)
 
-print "Started"
+# Start gathering data for the tabs in the background. The data is
+# collected once and shown on every screen
+collector_pool = CollectorPool()
 
-time_since_tab_change = 0
-last_time = time.time()
+for tab in tabs:
+    for collector in tab.get_collectors():
+        collector_pool.add(collector)
+        
+collector_pool.start()
 
-while True:
-    header.render_header(ctx, current_tab, tabs[current_tab].title, len(tabs))
-    tabs[current_tab].render_tab(ctx)
+if args.metrics_port is not None:
+    metrics.serve_metrics(args.metrics_port)
     
-    time_since_tab_change += time.time() - last_time
-    last_time = time.time()
+if args.metrics_file is not None:
+    metrics.write_metrics_periodically(args.metrics_file)
+
+displays = []
+
+for i, port in enumerate(ports):
+    display = Display(port, tabs,
+                      tab_change_interval=tab_change_intervals[min(i, len(tab_change_intervals)-1)],
+                      start_tab=start_tabs[min(i, len(start_tabs)-1)] - 1,
+                      use_framebuffer=not args.no_framebuffer,
+                      pacing_profile=PROFILES[args.pacing],
+                      boot_wait=args.boot_wait,
+                      pixel_mode=args.pixel_mode,
+                      render_budget=args.render_budget)
     
-    if time_since_tab_change >= tab_change_interval and len(tabs) > 1:
-        time_since_tab_change = 0
-        current_tab += 1
-        if current_tab > len(tabs)-1:
-            current_tab = 0
-            
-        # Make the erasing maneuver a bit faster by temporarily changing
-        # the font size to 4
-        ctx.set_text_size(4)
-        ctx.erase_rows(1, ctx.get_rows()-1)
-        ctx.set_text_size(2)
\ No newline at end of file
+    atexit.register(display.cleanup)
+    displays.append(display.start())
+
+# The displays run on their own threads
+while True:
+    time.sleep(1)
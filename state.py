@@ -0,0 +1,199 @@
+"""
+Keeps state that should survive restarts, such as how long websites have been down
+"""
+import os
+import json
+import base64
+import threading
+import time
+
+def encode_value(value):
+    """
+    Encode values json can't, which are numpy arrays
+    """
+    if hasattr(value, "dtype"):
+        return {"__array__": base64.b64encode(value.tobytes()),
+                "dtype": value.dtype.str,
+                "shape": list(value.shape)}
+    
+    raise TypeError("%r can't be stored" % value)
+
+def decode_value(value):
+    if "__array__" in value:
+        # Imported here, so that numpy is only loaded if arrays have been stored
+        import numpy
+        
+        return numpy.frombuffer(base64.b64decode(value["__array__"]),
+                                dtype=value["dtype"]).reshape(value["shape"])
+    
+    return value
+
+def format_entry(key, value):
+    return json.dumps({"key": key, "value": value}, separators=(",", ":"), default=encode_value) + "\n"
+
+class StateStore:
+    """
+    Stores JSON values by key in an append-only file. Changed values are kept in
+    memory and appended in batches, so the file is written at most once per flush
+    interval. The file is rewritten with only the latest values once it grows
+    past half of max_size, and at most max_size bytes are read when loading it
+    """
+    def __init__(self, path, max_size=1024*1024):
+        self.path = path
+        self.max_size = max_size
+        
+        self.values = {}
+        
+        # Values that haven't been written yet
+        self.dirty = {}
+        
+        self.lock = threading.Lock()
+        
+        # Held while writing, so that the file isn't appended to while it's replaced
+        self.write_lock = threading.Lock()
+    
+    def load(self):
+        """
+        Read the latest values from the end of the file. Lines that can't be
+        decoded, such as one cut off by a crash, are skipped
+        """
+        try:
+            with open(self.path, "rb") as state_file:
+                state_file.seek(0, os.SEEK_END)
+                size = state_file.tell()
+                
+                state_file.seek(max(size - self.max_size, 0))
+                data = state_file.read(self.max_size)
+        except IOError:
+            return self
+        
+        lines = data.split("\n")
+        
+        # The first line may have been cut off by the size limit
+        if size > self.max_size:
+            lines = lines[1:]
+        
+        with self.lock:
+            for line in lines:
+                try:
+                    entry = json.loads(line, object_hook=decode_value)
+                    self.values[entry["key"]] = entry["value"]
+                except (ValueError, KeyError, TypeError):
+                    continue
+        
+        return self
+    
+    def get(self, key, default=None):
+        with self.lock:
+            return self.values.get(key, default)
+    
+    def put(self, key, value):
+        """
+        Set the value, which is written on the next flush
+        """
+        with self.lock:
+            self.values[key] = value
+            self.dirty[key] = value
+    
+    def flush(self):
+        """
+        Append the changed values to the file
+        """
+        with self.write_lock:
+            with self.lock:
+                dirty = self.dirty
+                self.dirty = {}
+                
+            if not dirty:
+                return
+            
+            try:
+                data = "".join([ format_entry(key, value) for key, value in dirty.items() ])
+                
+                with open(self.path, "ab") as state_file:
+                    state_file.write(data)
+                    state_file.flush()
+                    os.fsync(state_file.fileno())
+                    
+                    size = state_file.tell()
+            except (IOError, OSError):
+                # Try again on the next flush, unless the values have been changed meanwhile
+                with self.lock:
+                    for key, value in dirty.items():
+                        self.dirty.setdefault(key, value)
+                        
+                raise
+            
+            if size > self.max_size / 2:
+                self.compact()
+    
+    def compact(self):
+        """
+        Replace the file with one containing only the latest values
+        """
+        with self.lock:
+            values = self.values.items()
+            
+        data = "".join([ format_entry(key, value) for key, value in values ])
+        
+        if len(data) > self.max_size / 2:
+            print "State is %d bytes, which is more than half of the maximum size %d" % (len(data), self.max_size)
+        
+        temp_path = "%s.tmp" % self.path
+        
+        with open(temp_path, "wb") as state_file:
+            state_file.write(data)
+            state_file.flush()
+            os.fsync(state_file.fileno())
+        
+        os.rename(temp_path, self.path)
+    
+    def start(self, interval=300):
+        """
+        Flush every interval seconds on a background thread
+        """
+        def flush_loop():
+            while True:
+                time.sleep(interval)
+                
+                try:
+                    self.flush()
+                except (IOError, OSError) as e:
+                    print "Couldn't write state to %s: %s" % (self.path, e)
+        
+        thread = threading.Thread(target=flush_loop, name="state-writer")
+        thread.daemon = True
+        thread.start()
+        
+        return self
+
+def track_tabs(store, tabs):
+    """
+    Restore the state of the tabs from the store, and put their state into
+    it whenever one of their collectors has run. Must be called before
+    the collectors are started
+    """
+    counts = {}
+    
+    for tab in tabs:
+        # Tabs are told apart by their class and their position among the tabs of that class
+        name = tab.__class__.__name__
+        key = "%s/%d" % (name, counts.get(name, 0))
+        counts[name] = counts.get(name, 0) + 1
+        
+        state = store.get(key)
+        
+        if state is not None:
+            try:
+                tab.restore_state(state)
+            except Exception as e:
+                print "Couldn't restore the state of %s: %s" % (key, e)
+                
+        def save_state(collector, key=key, tab=tab):
+            state = tab.get_state()
+            
+            if state is not None:
+                store.put(key, state)
+                
+        for collector in tab.get_collectors():
+            collector.add_listener(save_state)
@@ -0,0 +1,152 @@
+from bisect import bisect_left
+
+class RateEstimator:
+    """
+    Estimates how fast a sampled counter grows using an exponentially
+    weighted moving average, so that older samples matter less over time
+    """
+    def __init__(self, half_life=300):
+        self.half_life = float(half_life)
+        
+        # Per-second rate, None until two samples have been added
+        self.rate = None
+        
+        self.last_count = None
+        self.last_time = None
+    
+    def add_sample(self, count, timestamp):
+        """
+        Add a sample of the counter taken at the provided time
+        """
+        if self.last_count is not None and timestamp > self.last_time:
+            elapsed = timestamp - self.last_time
+            rate = float(count - self.last_count) / elapsed
+            
+            if self.rate is None:
+                self.rate = rate
+            else:
+                # The longer the interval, the more the new rate weighs
+                weight = 1.0 - 0.5 ** (elapsed / self.half_life)
+                self.rate += weight * (rate - self.rate)
+        
+        self.reset_baseline(count, timestamp)
+    
+    def reset_baseline(self, count, timestamp):
+        """
+        Continue from the provided sample without deriving a rate from it,
+        eg. when the counter has been changed by something else
+        """
+        self.last_count = count
+        self.last_time = timestamp
+    
+    def get_state(self):
+        return [ self.rate, self.last_count, self.last_time ]
+    
+    def restore_state(self, state):
+        self.rate, self.last_count, self.last_time = state
+
+class RingBuffer:
+    """
+    Keeps the latest capacity samples in a preallocated array, so memory use
+    stays constant no matter how many samples are added. Each sample is a single
+    value, or a row of width values.
+    
+    The samples are stored consecutively in an array three times the capacity and
+    moved to its start once it fills up, so the latest samples can always be read
+    as a single view of the array without copying. A view stays unchanged
+    for at least capacity more appends
+    """
+    def __init__(self, capacity, width=None, dtype=None):
+        # Imported here, so that tabs that don't keep a history don't have to load numpy
+        import numpy
+        
+        dtype = dtype or numpy.float32
+        
+        self.capacity = capacity
+        
+        if width is None:
+            self.data = numpy.zeros(capacity * 3, dtype=dtype)
+        else:
+            self.data = numpy.zeros((capacity * 3, width), dtype=dtype)
+            
+        # Where the next sample is written and how many samples are kept
+        self.end = 0
+        self.count = 0
+    
+    def append(self, sample):
+        if self.end == len(self.data):
+            # Move the latest samples to the start to make room
+            self.data[:self.capacity - 1] = self.data[self.end - self.capacity + 1:self.end]
+            self.end = self.capacity - 1
+            
+        self.data[self.end] = sample
+        self.end += 1
+        self.count = min(self.count + 1, self.capacity)
+    
+    def get_view(self):
+        """
+        Returns a read-only view of the samples from oldest to newest
+        """
+        view = self.data[self.end - self.count:self.end]
+        view.flags.writeable = False
+        
+        return view
+    
+    def __len__(self):
+        return self.count
+
+class LatencyHistogram:
+    """
+    Counts latencies into fixed buckets, weighing older latencies less with
+    every latency added so that the quantiles follow recent changes. Memory
+    use is the same however many latencies have been added
+    """
+    # Upper bounds of the buckets in seconds. The last bucket holds anything longer
+    BUCKETS = (0.01, 0.02, 0.03, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.5,
+               0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0)
+    
+    def __init__(self, half_life=30):
+        # Latencies count half as much after half_life more have been added
+        self.decay = 0.5 ** (1.0 / half_life)
+        
+        self.counts = [ 0.0 ] * (len(self.BUCKETS) + 1)
+    
+    def add(self, latency):
+        self.counts = [ count * self.decay for count in self.counts ]
+        self.counts[bisect_left(self.BUCKETS, latency)] += 1
+    
+    def get_quantile(self, quantile):
+        """
+        Returns the latency below which the quantile of the latencies fall, interpolated
+        within its bucket. None if no latencies have been added
+        """
+        total = sum(self.counts)
+        
+        if total == 0:
+            return None
+        
+        rank = quantile * total
+        
+        # Find the bucket the rank falls in and how many latencies are below it
+        below = 0.0
+        
+        for i, count in enumerate(self.counts):
+            if below + count >= rank:
+                break
+            
+            below += count
+        
+        if i == len(self.BUCKETS):
+            return self.BUCKETS[-1]
+        
+        lower = self.BUCKETS[i - 1] if i > 0 else 0.0
+        
+        return lower + (self.BUCKETS[i] - lower) * (rank - below) / self.counts[i]
+    
+    def get_state(self):
+        return list(self.counts)
+    
+    def restore_state(self, state):
+        # The counts are left out if the buckets have changed
+        if len(state) == len(self.counts):
+            self.counts = [ float(count) for count in state ]
@@ -0,0 +1,105 @@
+"""
+Tabs are referred to by name in config.py, and the module of a tab is only
+imported when the tab is first created, so tabs that aren't used don't cost
+any import time or require their dependencies to be installed
+"""
+import __builtin__
+import sys
+import time
+
+# The module each tab is defined in, by the name of the tab
+TAB_MODULES = {"SystemStats": "tabs.sysinfo",
+               "DiskUsage": "tabs.sysinfo",
+               "WebsiteUptime": "tabs.uptime",
+               "Bitcoind": "tabs.bitcoin",
+               "BitcoinPrice": "tabs.bitcoin"}
+
+# (module name, nesting depth, seconds) for each module imported by create_tab,
+# in the order their imports started
+import_times = []
+
+def import_timed(module_name):
+    """
+    Import the module, recording how long it and each module it newly
+    imports took, including the modules they import in turn. Imports made
+    by other threads meanwhile would be recorded too, so tabs should be
+    created before starting any
+    """
+    original_import = __builtin__.__import__
+    depth = [ 0 ]
+    
+    def timed_import(name, *args, **kwargs):
+        if name in sys.modules:
+            return original_import(name, *args, **kwargs)
+        
+        entry = [ name, depth[0], 0.0 ]
+        import_times.append(entry)
+        
+        depth[0] += 1
+        start_time = time.time()
+        
+        try:
+            return original_import(name, *args, **kwargs)
+        finally:
+            entry[2] = time.time() - start_time
+            depth[0] -= 1
+            
+            # Imports that failed are left out
+            if sys.modules.get(name) is None:
+                import_times.remove(entry)
+    
+    __builtin__.__import__ = timed_import
+    
+    try:
+        timed_import(module_name)
+    finally:
+        __builtin__.__import__ = original_import
+    
+    return sys.modules[module_name]
+
+def create_tab(name, config=None):
+    """
+    Create the named tab with the provided settings
+    """
+    if name not in TAB_MODULES:
+        raise ValueError("Unknown tab %s, available tabs are %s" % (name, ", ".join(sorted(TAB_MODULES))))
+    
+    module = sys.modules.get(TAB_MODULES[name])
+    
+    if module is None:
+        module = import_timed(TAB_MODULES[name])
+    
+    if config is None:
+        return getattr(module, name)()
+    
+    return getattr(module, name)(config)
+
+def create_tabs(entries):
+    """
+    Create tabs from config.py entries, which are either a tab name, a (name, settings)
+    tuple or an already created tab
+    """
+    tabs = []
+    
+    for entry in entries:
+        if isinstance(entry, basestring):
+            tabs.append(create_tab(entry))
+        elif isinstance(entry, tuple):
+            tabs.append(create_tab(*entry))
+        else:
+            tabs.append(entry)
+    
+    return tabs
+
+def format_import_times(min_time=0.001):
+    """
+    Returns a report of the modules imported for the tabs that took
+    at least min_time seconds
+    """
+    lines = []
+    
+    for name, depth, seconds in import_times:
+        if seconds >= min_time:
+            lines.append("%s%-*s %6.3f s" % ("  " * depth, 30 - 2 * depth, name, seconds))
+    
+    return "\n".join(lines)
@@ -1,15 +1,17 @@
-from context import Screen, ScreenContext
+from context import Screen
 from tab import Tab
+from collector import Collector, Snapshot, run_first
+from rpc import JsonRpcClient, RPCError, METHOD_NOT_FOUND
+from stats import RateEstimator
 
 from utils import format_timespan
 
-import sys
 import time
+import threading
+
+from collections import OrderedDict
 import urllib2
-import httplib
 import json
-import random
-import pyjsonrpc
 import socket
 
 class Bitcoind(Tab):
@@ -23,12 +25,10 @@ class Bitcoind(Tab):
         
         self.addrlocal = "N/A"
         
-        self.utx_count_on_block = -1
         self.utx_count = 0
         
-        # The time since last block or when we started tracking new transactions
-        # (eg. on first tab launch)
-        self.utx_start_time = -1
+        # Estimates tx/s from the sampled mempool sizes
+        self.tx_rate = RateEstimator()
         
         self.connections = 0
         self.inbound = 0
@@ -39,8 +39,16 @@ class Bitcoind(Tab):
         
         self.last_block_time = int(time.time())
         
+        # Block headers by hash, so that the header of an unchanged tip is never fetched again
+        self.block_headers = OrderedDict()
+        self.MAX_BLOCK_HEADERS = 16
+        
+        # Older bitcoind versions don't have getmempoolinfo or getblockheader,
+        # in which case the full mempool and block have to be fetched instead
+        self.use_summary_calls = True
+        
         # Create the JSON-RPC client
-        self.client = pyjsonrpc.HttpClient(
+        self.client = JsonRpcClient(
             url = config["host"],
             username = config["username"],
             password = config["password"],
@@ -48,41 +56,108 @@ class Bitcoind(Tab):
             timeout = 4
         )
         
-        self.error = None
+        self.collector = Collector("bitcoind", self.fetch_stats, 5)
         
-    def update_stats(self):
-        self.error = None
+    def get_collectors(self):
+        return [ self.collector ]
+    
+    def get_refresh_interval(self):
+        # Time since the last block is shown in seconds
+        return 1
+    
+    def get_state(self):
+        snapshot = self.collector.snapshot
+        
+        if snapshot.data is None:
+            return None
+        
+        # The mempool size the tx/s estimate continues from is kept, so that
+        # the estimate is valid right after a restart
+        return {"tx_rate": self.tx_rate.get_state(),
+                "stats": snapshot.data,
+                "timestamp": snapshot.timestamp}
+    
+    def restore_state(self, state):
+        stats = state["stats"]
+        stats["errors"] = tuple(stats["errors"])
+        
+        self.tx_rate.restore_state(state["tx_rate"])
         
+        self.addrlocal = stats["addrlocal"]
+        self.block_count = stats["block_count"]
+        self.utx_count = stats["utx_count"]
+        self.last_block_time = stats["last_block_time"]
+        
+        self.collector.snapshot = Snapshot(stats, state["timestamp"], None)
+        
+    def fetch_stats(self):
         try:
-            blockcount = self.client.getblockcount()
-            peers = self.client.getpeerinfo()
-            utx = self.client.getrawmempool()
-            
-            bestblockhash = self.client.getbestblockhash()
+            return self.update_stats()
+        except RPCError as e:
+            if self.use_summary_calls and e.code == METHOD_NOT_FOUND:
+                print "bitcoind doesn't support getmempoolinfo or getblockheader, fetching full mempool and blocks instead"
+                self.use_summary_calls = False
+                
+                return self.update_stats()
             
-            latest_block = self.client.getblock(bestblockhash)
+            raise
         except socket.timeout:
-            print "Request timed out, bitcoind probably busy"
-            self.error = "Request timed out, bitcoind probably busy"
-            return
-        except urllib2.URLError as e:
-            print "Couldn't connect to bitcoind, error: %s" % e
-            self.error = e
-            return
+            raise Exception("Request timed out, bitcoind probably busy")
+        
+    def update_stats(self):
+        errors = []
         
-        if 'error' in peers or \
-           'error' in utx or \
-           'error' in latest_block:
-            print "Error in response, skipping"
+        if self.use_summary_calls:
+            mempool_call = ("getmempoolinfo", [])
         else:
-            if self.block_count != blockcount:
-                self.utx_count_on_block = len(utx)
+            mempool_call = ("getrawmempool", [])
+        
+        # Send the calls as a single batch
+        results = self.client.batch([ ("getblockcount", []),
+                                      ("getpeerinfo", []),
+                                      mempool_call,
+                                      ("getbestblockhash", []) ])
+        
+        sample_time = time.time()
+        
+        (blockcount, blockcount_error), (peers, peers_error), \
+            (mempool, mempool_error), (bestblockhash, bestblockhash_error) = results
+        
+        # The header of the best block can only be requested once we know its hash
+        latest_block, latest_block_error = None, bestblockhash_error
+        
+        if bestblockhash_error is None:
+            latest_block, latest_block_error = self.get_block_header(bestblockhash)
+            
+        for error in (mempool_error, latest_block_error):
+            if error is not None and error.code == METHOD_NOT_FOUND:
+                raise error
+        
+        # Keep the previous values for the calls that failed
+        for name, error in (("getblockcount", blockcount_error),
+                            ("getpeerinfo", peers_error),
+                            (mempool_call[0], mempool_error),
+                            ("getblockheader", latest_block_error)):
+            if error is not None:
+                print "%s failed: %s" % (name, error)
+                errors.append("%s failed" % name)
                 
-                if self.utx_start_time != -1:
-                    self.utx_start_time = int(time.time())
+        if len(errors) == len(results):
+            raise Exception("Error in response, skipping")
+        
+        if mempool_error is None:
+            if self.use_summary_calls:
+                utx_count = mempool["size"]
+            else:
+                utx_count = len(mempool)
                 
-            self.block_count = blockcount
+            self.update_tx_rate(utx_count, sample_time, blockcount if blockcount_error is None else None, latest_block)
+            self.utx_count = utx_count
         
+        if blockcount_error is None:
+            self.block_count = blockcount
+            
+        if peers_error is None:
             self.connections = 0
             self.inbound = 0
             self.outbound = 0
@@ -98,60 +173,105 @@ class Bitcoind(Tab):
                 if 'addrlocal' in peer:
                     self.addrlocal = peer['addrlocal']
                 
-            self.utx_count = len(utx)
+        # Get the timestamp from the latest block if it's available            
+        if latest_block is not None and 'time' in latest_block:
+            self.last_block_time = latest_block['time']
+                
+        return {"addrlocal": self.addrlocal,
+                "connections": self.connections,
+                "inbound": self.inbound,
+                "outbound": self.outbound,
+                "block_count": self.block_count,
+                "utx_count": self.utx_count,
+                "tx_per_second": self.tx_rate.rate,
+                "last_block_time": self.last_block_time,
+                "errors": tuple(errors)}
+    
+    def get_block_header(self, block_hash):
+        """
+        Returns a (header, error) tuple for the block, using the cached header if possible
+        """
+        if block_hash in self.block_headers:
+            return self.block_headers[block_hash], None
+        
+        if self.use_summary_calls:
+            header, error = self.client.batch([ ("getblockheader", [ block_hash ]) ])[0]
+        else:
+            header, error = self.client.batch([ ("getblock", [ block_hash ]) ])[0]
             
-            # Get the timestamp from the latest block if it's available            
-            if 'time' in latest_block:
-                self.last_block_time = latest_block['time']
-            else:
-                self.last_block_time = self.utx_start_time
-                    
-            # If this is the first time we ever fetched the transactions,
-            # set the current time as the starting point for calculating tx/s
-            if self.utx_start_time == -1:
-                self.utx_start_time = int(time.time())
+            # Only keep what we need from the full block
+            if error is None:
+                header = {"time": header.get("time"), "height": header.get("height"),
+                          "nTx": len(header.get("tx", []))}
+            
+        if error is None:
+            self.block_headers[block_hash] = header
+            
+            while len(self.block_headers) > self.MAX_BLOCK_HEADERS:
+                self.block_headers.popitem(last=False)
+                
+        return header, error
     
+    def update_tx_rate(self, utx_count, sample_time, blockcount, latest_block):
+        """
+        Update the tx/s estimate with a new mempool size sample
+        """
+        if blockcount is None or self.block_count == 0 or blockcount == self.block_count:
+            # No new blocks, so the mempool has only grown by the new transactions
+            self.tx_rate.add_sample(utx_count, sample_time)
+        elif blockcount == self.block_count + 1 and latest_block is not None and "nTx" in latest_block:
+            # The new block removed its transactions (minus the coinbase) from the mempool
+            self.tx_rate.add_sample(utx_count + latest_block["nTx"] - 1, sample_time)
+            self.tx_rate.reset_baseline(utx_count, sample_time)
+        else:
+            # Several blocks were found, so we can't tell how many transactions arrived
+            self.tx_rate.reset_baseline(utx_count, sample_time)
+        
     def render_tab(self, ctx):
-        self.update_stats()
+        snapshot = self.collector.snapshot
+        stats = snapshot.data
         
-        if self.error:
-            ctx.fg_color(Screen.RED).write_line(str(self.error)).fg_color(Screen.WHITE)
+        if snapshot.error:
+            ctx.fg_color(Screen.RED).write_line(str(snapshot.error)).fg_color(Screen.WHITE)
+            return
+        elif stats is None:
+            ctx.write_line("Loading...")
             return
         
         ctx.bg_color(Screen.BLACK).fg_color(Screen.YELLOW).write_line(self.host.replace("http://", "")).linebreak()
         
         ctx.fg_color(Screen.WHITE).write("Connections: ")
         
-        if self.connections < self.CONNECTION_YELLOW_THRESHOLD:
+        if stats["connections"] < self.CONNECTION_YELLOW_THRESHOLD:
             ctx.fg_color(Screen.RED)
-        elif self.connections >= self.CONNECTION_YELLOW_THRESHOLD and self.connections <= self.CONNECTION_GREEN_THRESHOLD:
+        elif stats["connections"] >= self.CONNECTION_YELLOW_THRESHOLD and stats["connections"] <= self.CONNECTION_GREEN_THRESHOLD:
             ctx.fg_color(Screen.YELLOW)
         else:
             ctx.fg_color(Screen.GREEN)
         
-        ctx.write_line(str(self.connections))
-        ctx.fg_color(Screen.WHITE).write("    inbound: ").fg_color(Screen.YELLOW).write_line(str(self.inbound))
-        ctx.fg_color(Screen.WHITE).write("   outbound: ").fg_color(Screen.YELLOW).write_line(str(self.outbound)).linebreak()
+        ctx.write_line(str(stats["connections"]))
+        ctx.fg_color(Screen.WHITE).write("    inbound: ").fg_color(Screen.YELLOW).write_line(str(stats["inbound"]))
+        ctx.fg_color(Screen.WHITE).write("   outbound: ").fg_color(Screen.YELLOW).write_line(str(stats["outbound"])).linebreak()
         
-        ctx.fg_color(Screen.WHITE).write("Blocks: ").fg_color(Screen.YELLOW).write_line(str(self.block_count))
-        ctx.fg_color(Screen.WHITE).write("Unconf. tx: ").linebreak().fg_color(Screen.YELLOW).write(str(self.utx_count))
+        ctx.fg_color(Screen.WHITE).write("Blocks: ").fg_color(Screen.YELLOW).write_line(str(stats["block_count"]))
+        ctx.fg_color(Screen.WHITE).write("Unconf. tx: ").linebreak().fg_color(Screen.YELLOW).write(str(stats["utx_count"]))
         
         current_time = int(time.time())
-        time_since_start = current_time - self.utx_start_time
+        time_since_block = current_time - stats["last_block_time"]
         
-        if time_since_start != 0:
-            tx_per_second = float(self.utx_count - self.utx_count_on_block) / float(time_since_start)
+        if stats["tx_per_second"] is not None:
+            ctx.write_line(" (%.2f tx/s)" % stats["tx_per_second"]).fg_color(Screen.WHITE)
         else:
-            tx_per_second = 0.0
-            
-        time_since_block = current_time - self.last_block_time
-        
-        ctx.write_line(" (%.2f tx/s)" % tx_per_second).fg_color(Screen.WHITE)
+            ctx.write_line(" (-- tx/s)").fg_color(Screen.WHITE)
         
         ctx.write_line("Time since block: ").fg_color(Screen.YELLOW).write_line(format_timespan(time_since_block))
         
+        # Show which calls failed if only some of them did
+        if stats["errors"]:
+            ctx.fg_color(Screen.RED).write_line(", ".join(stats["errors"])).fg_color(Screen.WHITE)
+        
 class BitcoinPrice(Tab):
-    def __init__(self):
+    def __init__(self, config={}):
         self.title = "Bitcoin price"
         
         self.last = 0.0
@@ -159,10 +279,7 @@ class BitcoinPrice(Tab):
         self.high = 0.0
         self.low = 0.0
         
-        self.price_data = {"source": "Couldn't update price",
-                           "data": {}}
-        
-        # The price sources are checked starting from the first one
+        # The price sources are checked starting from the one that has worked best
         # until a valid response is received
         self.price_sources = [{"api_url": "https://api.bitcoinaverage.com/ticker/global/USD/",
                                "name": "BitcoinAverage",
@@ -179,45 +296,121 @@ class BitcoinPrice(Tab):
                                          "24h avg": "vwap"}},]
         
         self.UPDATE_INTERVAL = 120
-        self.last_update = 0
-        
-    def update_price(self):
-        current_time = time.time()
-        
-        if current_time >= self.last_update + 60:
-            # Go through all of the available price sources until we have one that works
-            for source in self.price_sources:
-                try:
-                    print "Updating %s" % source["name"]
-                    response = urllib2.urlopen(source["api_url"]).read()
-                    response = json.loads(response)
-                except:
-                    # Couldn't retrieve ticker data, proceed to next source in the list
-                    print "Couldn't retrieve ticker data from %s, skipping..." % source["name"]
-                    continue
-                
-                self.price_data["source"] = source["name"]
-                self.price_data["data"] = {}
-                
-                for name, key in source["data"].iteritems():
-                    self.price_data["data"][name] = float(response[key])
+        
+        # How long all of the sources may take in total, and how long to wait
+        # for a source before also querying the next one
+        self.DEADLINE = 15
+        self.HEDGE_DELAY = 2
+        
+        # Consecutive failures and average latency for each source
+        self.source_stats = {}
+        self.source_stats_lock = threading.Lock()
+        
+        for source in self.price_sources:
+            self.source_stats[source["name"]] = {"failures": 0, "latency": 0.0}
+        
+        self.collector = Collector("bitcoin_price", self.fetch_price, self.UPDATE_INTERVAL)
+        
+    def get_collectors(self):
+        return [ self.collector ]
+    
+    def get_refresh_interval(self):
+        # The age of the quote is shown in seconds
+        return 1
+    
+    def get_state(self):
+        snapshot = self.collector.snapshot
+        
+        if snapshot.data is None:
+            return None
+        
+        with self.source_stats_lock:
+            source_stats = dict([ (name, dict(stats)) for name, stats in self.source_stats.items() ])
+            
+        return {"price_data": snapshot.data,
+                "timestamp": snapshot.timestamp,
+                "source_stats": source_stats}
+    
+    def restore_state(self, state):
+        with self.source_stats_lock:
+            for name, stats in state["source_stats"].items():
+                if name in self.source_stats:
+                    self.source_stats[name] = stats
                     
-                # Stop updating after the first working result
-                break
+        # The last quote is shown with its age until a new one is received
+        self.collector.snapshot = Snapshot(state["price_data"], state["timestamp"], None)
+        
+    def fetch_price(self):
+        # Sources that keep failing are tried last, and slow ones after fast ones
+        with self.source_stats_lock:
+            sources = sorted(self.price_sources,
+                             key=lambda source: (self.source_stats[source["name"]]["failures"],
+                                                 self.source_stats[source["name"]]["latency"]))
+            
+        tasks = [ (lambda source=source: self.query_source(source)) for source in sources ]
+        
+        # The first valid answer wins, the collector keeps the last good quote if there's none
+        i, price_data = run_first(tasks, self.DEADLINE, self.HEDGE_DELAY)
+        
+        return price_data
+    
+    def query_source(self, source):
+        """
+        Retrieve ticker data from a source, keeping track of how well it works
+        """
+        start_time = time.time()
+        
+        try:
+            print "Updating %s" % source["name"]
+            response = urllib2.urlopen(source["api_url"], timeout=self.DEADLINE).read()
+            response = json.loads(response)
+            
+            price_data = {"source": source["name"],
+                          "data": {}}
+            
+            for name, key in source["data"].iteritems():
+                price_data["data"][name] = float(response[key])
+        except Exception as e:
+            print "Couldn't retrieve ticker data from %s: %s" % (source["name"], e)
+            
+            with self.source_stats_lock:
+                self.source_stats[source["name"]]["failures"] += 1
                 
-            self.last_update = current_time
+            raise
+        
+        with self.source_stats_lock:
+            stats = self.source_stats[source["name"]]
+            
+            stats["failures"] = 0
+            stats["latency"] = 0.7 * stats["latency"] + 0.3 * (time.time() - start_time)
+            
+        return price_data
         
     def render_tab(self, ctx):
-        # Update price if it hasn't been updated in the last 10 minutes
-        self.update_price()
+        snapshot = self.collector.snapshot
+        price_data = snapshot.data
+        
+        if price_data is None:
+            if snapshot.error:
+                ctx.write_line("Couldn't update price")
+            else:
+                ctx.write_line("Loading...")
+            return
+        
+        # Write the source and how old the quote is
+        ctx.write_line(price_data["source"])
         
-        # Write the source
-        ctx.write_line(self.price_data["source"]).linebreak()
+        if snapshot.error:
+            ctx.fg_color(Screen.RED)
+        else:
+            ctx.fg_color(Screen.YELLOW)
+            
+        ctx.write_line("%s ago" % format_timespan(snapshot.get_age())).fg_color(Screen.WHITE)
         
         ctx.set_text_size(3)
         
         # Write the data
-        for entry, value in self.price_data["data"].iteritems():
+        for entry, value in price_data["data"].iteritems():
             ctx.write_line(entry).fg_color(Screen.YELLOW).write_line("$%.2f" % value).fg_color(Screen.WHITE).linebreak()
         
         #ctx.set_text_size(3).bg_color(Screen.BLACK).write("Last ").fg_color(Screen.YELLOW).linebreak().write_line("$%.2f" % self.last).linebreak()
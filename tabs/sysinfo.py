@@ -1,118 +1,296 @@
 from context import Screen, ScreenContext
 from tab import Tab
+from collector import Collector, DeadlineExceeded, run_concurrently
+from stats import RingBuffer
 
 import psutil
 import time
+import threading
 import humanfriendly
 
-from utils import format_timespan, get_progress_bar
+from collections import OrderedDict
 
-class SystemStats(Tab):
-    def __init__(self):
-        self.title = "System stats"
+from utils import format_timespan, get_progress_bar, get_sparkline
+
+def get_usage_color(usage, yellow_threshold, red_threshold):
+    if usage < yellow_threshold:
+        return Screen.GREEN
+    elif usage >= yellow_threshold and usage <= red_threshold:
+        return Screen.YELLOW
+    else:
+        return Screen.RED
+
+def draw_usage_bar(ctx, usage, yellow_threshold, red_threshold):
+    """
+    Draw the usage between 0 and 1 as a bar colored by the thresholds, taking up
+    a line. In pixel mode the bar is drawn as an image, otherwise as text
+    """
+    color = get_usage_color(usage, yellow_threshold, red_threshold)
+    
+    ctx.fg_color(Screen.WHITE)
+    
+    if ctx.pixel_mode:
+        # Imported here, as pixel mode requires numpy
+        import widgets
+        
+        width = ctx.get_resolution()[0]
+        height = ctx.text_size * 8
         
-        self.cpu_usages = [0.0] * len(psutil.cpu_percent(percpu=True))
+        ctx.draw_pixels_inline(widgets.render_bar(width, height, usage, color), width, height)
+    else:
+        ctx.write("[").fg_color(color).write(get_progress_bar(ctx.get_columns()-2, usage)).fg_color(Screen.WHITE).write("]")
         
-        self.used_ram = 12505903
-        self.total_ram = 20189390
+    return ctx
+
+class SystemStats(Tab):
+    def __init__(self, config={}):
+        self.title = "System stats"
         
         self.YELLOW_THRESHOLD = 0.33
         self.RED_THRESHOLD = 0.66
         
-        self.uptime = 0
+        self.UPDATE_INTERVAL = 1
+        
+        # How many minutes of CPU and RAM usage are kept
+        self.history_minutes = config.get("history_minutes", 10)
+        
+        history_size = int(self.history_minutes * 60 / self.UPDATE_INTERVAL)
         
+        # Usage of each CPU and the RAM usage for every sample
+        self.cpu_history = RingBuffer(history_size, psutil.cpu_count())
+        self.ram_history = RingBuffer(history_size)
+        
+        self.collector = Collector("sysinfo", self.fetch_sysinfo, self.UPDATE_INTERVAL)
+    
+    def get_collectors(self):
+        return [ self.collector ]
+    
     def render_tab(self, ctx):
-        # Update system info
-        self.update_sysinfo()
+        sysinfo = self.collector.snapshot.data
+        
+        if sysinfo is None:
+            ctx.write_line("Loading...")
+            return
         
         # Print CPU usage
-        for i in range(0, len(self.cpu_usages)):
-            cpu_usage = self.cpu_usages[i]
+        for i in range(0, len(sysinfo["cpu_usages"])):
+            cpu_usage = sysinfo["cpu_usages"][i]
             
             ctx.fg_color(Screen.WHITE)
             
-            ctx.write("CPU %d:" % i).fg_color(Screen.YELLOW).write_line(" %.2f %%" % (cpu_usage*100)).fg_color(Screen.WHITE).write("[")
+            ctx.write("CPU %d:" % i).fg_color(Screen.YELLOW).write_line(" %.2f %%" % (cpu_usage*100))
             
-            if cpu_usage < self.YELLOW_THRESHOLD:
-                ctx.fg_color(Screen.GREEN)
-            elif cpu_usage >= self.YELLOW_THRESHOLD and cpu_usage <= self.RED_THRESHOLD:
-                ctx.fg_color(Screen.YELLOW)
-            else:
-                ctx.fg_color(Screen.RED)
-                
-            ctx.write(get_progress_bar(ctx.get_columns()-2, cpu_usage)).fg_color(Screen.WHITE).write("]")
+            draw_usage_bar(ctx, cpu_usage, self.YELLOW_THRESHOLD, self.RED_THRESHOLD)
+        
+        # Print the average CPU usage over the kept history
+        cpu_history = sysinfo["cpu_history"].mean(axis=1)
+        
+        ctx.write("CPU").fg_color(Screen.YELLOW).write_line(self.format_history(cpu_history))
+        
+        if ctx.pixel_mode:
+            import widgets
             
+            width = ctx.get_resolution()[0]
+            height = ctx.text_size * 8
+            
+            ctx.draw_pixels_inline(widgets.render_sparkline(width, height, cpu_history, Screen.YELLOW), width, height)
+            ctx.fg_color(Screen.WHITE)
+        else:
+            ctx.write_line(get_sparkline(cpu_history, ctx.get_columns())).fg_color(Screen.WHITE)
+        
         # Print RAM
-        used = humanfriendly.format_size(self.used_ram)
-        total = humanfriendly.format_size(self.total_ram)
-        ctx.linebreak().write_line("RAM").fg_color(Screen.YELLOW).write_line("%s / %s" % (used, total)).fg_color(Screen.WHITE)
+        used = humanfriendly.format_size(sysinfo["used_ram"])
+        total = humanfriendly.format_size(sysinfo["total_ram"])
+        ctx.linebreak().write("RAM").fg_color(Screen.YELLOW).write_line(self.format_history(sysinfo["ram_history"]))
+        ctx.write_line("%s / %s" % (used, total)).fg_color(Screen.WHITE)
         
-        ram_usage = float(self.used_ram) / float(self.total_ram)
-            
-        ctx.write("[")
+        ram_usage = float(sysinfo["used_ram"]) / float(sysinfo["total_ram"])
         
-        if ram_usage < 0.33:
-            ctx.fg_color(Screen.GREEN)
-        elif ram_usage >= 0.33 and ram_usage <= 0.66:
-            ctx.fg_color(Screen.YELLOW)
-        else:
-            ctx.fg_color(Screen.RED)
+        if ctx.pixel_mode:
+            import widgets
             
-        ctx.write(get_progress_bar(ctx.get_columns()-2, ram_usage)).fg_color(Screen.WHITE).write("]")
+            # Show the RAM usage as a gauge two lines high
+            width = ctx.get_resolution()[0]
+            height = ctx.text_size * 16
+            
+            ctx.draw_pixels_inline(widgets.render_gauge(width, height, ram_usage,
+                                                        get_usage_color(ram_usage, self.YELLOW_THRESHOLD,
+                                                                        self.RED_THRESHOLD)),
+                                   width, height)
+        else:
+            draw_usage_bar(ctx, ram_usage, self.YELLOW_THRESHOLD, self.RED_THRESHOLD)
         
         # Print uptime
-        ctx.linebreak().write_line("Uptime:").fg_color(Screen.YELLOW).write_line("%s" % format_timespan(self.uptime)).fg_color(Screen.WHITE)
+        ctx.linebreak().write_line("Uptime:").fg_color(Screen.YELLOW).write_line("%s" % format_timespan(time.time() - sysinfo["boot_time"])).fg_color(Screen.WHITE)
+    
+    def get_state(self):
+        # The views are copied, as the history keeps changing until it's stored
+        return {"cpu_history": self.cpu_history.get_view().copy(),
+                "ram_history": self.ram_history.get_view().copy()}
+    
+    def restore_state(self, state):
+        # The history is left out if the amount of CPUs has changed
+        if state["cpu_history"].shape[1:] == self.cpu_history.data.shape[1:]:
+            for cpu_usages in state["cpu_history"][-self.cpu_history.capacity:]:
+                self.cpu_history.append(cpu_usages)
+                
+        for ram_usage in state["ram_history"][-self.ram_history.capacity:]:
+            self.ram_history.append(ram_usage)
+    
+    def format_history(self, history):
+        """
+        Format the lowest, highest and average usage in the history
+        """
+        return " %d-%d%%, avg %d%%" % (history.min() * 100, history.max() * 100, history.mean() * 100)
     
-    def update_sysinfo(self):
-        cpu_times = psutil.cpu_percent(percpu=True)
+    def fetch_sysinfo(self):
+        # Sample everything once per update, so that all of the values are from the same moment
+        cpu_usages = tuple([ float(cpu_time / 100) for cpu_time in psutil.cpu_percent(percpu=True) ])
         
-        for i, cpu_time in enumerate(cpu_times):
-            self.cpu_usages[i] = float(cpu_time / 100)
-            
-        self.total_ram = psutil.virtual_memory().total
-        self.used_ram = psutil.virtual_memory().total - psutil.virtual_memory().available
+        memory = psutil.virtual_memory()
+        used_ram = memory.total - memory.available
         
-        self.uptime = time.time() - psutil.boot_time()
+        self.cpu_history.append(cpu_usages)
+        self.ram_history.append(float(used_ram) / float(memory.total))
         
+        # The views aren't copied and stay unchanged until the history
+        # has been replaced by newer samples
+        return {"cpu_usages": cpu_usages,
+                "total_ram": memory.total,
+                "used_ram": used_ram,
+                "boot_time": psutil.boot_time(),
+                "cpu_history": self.cpu_history.get_view(),
+                "ram_history": self.ram_history.get_view()}
+
 class DiskUsage(Tab):
-    def __init__(self):
+    # The mount table, which is compared to decide when partitions have to be listed again
+    MOUNT_TABLE = "/proc/self/mounts"
+    
+    # Filesystems that don't store anything on a disk
+    PSEUDO_FILESYSTEMS = set([ "autofs", "binfmt_misc", "bpf", "cgroup", "cgroup2", "configfs",
+                               "debugfs", "devpts", "devtmpfs", "efivarfs", "fusectl", "hugetlbfs",
+                               "mqueue", "nsfs", "proc", "pstore", "ramfs", "rpc_pipefs",
+                               "securityfs", "selinuxfs", "squashfs", "sysfs", "tmpfs", "tracefs" ])
+    
+    def __init__(self, config={}):
         self.title = "Disk usage"
         
-        self.disk_usage = {}
-        
         self.YELLOW_THRESHOLD = 0.33
         self.RED_THRESHOLD = 0.66
         
+        # How long checking a single mount may take before it's shown as stale
+        self.timeout = config.get("timeout", 2)
+        
+        # Partitions are only listed again when the mount table changes
+        self.mount_table = None
+        self.partitions = []
+        
+        # Mounts that are still being checked. A hung mount keeps its check
+        # running, so it isn't checked again until that check finishes
+        self.pending = set()
+        self.pending_lock = threading.Lock()
+        
+        # Latest usage of each mount
+        self.disk_usage = {}
+        
+        self.collector = Collector("disk_usage", self.fetch_disk_usage, 5)
+    
+    def get_collectors(self):
+        return [ self.collector ]
+    
     def render_tab(self, ctx):
-        self.update_disk_usage()
+        disk_usage = self.collector.snapshot.data
         
-        for device_name, usage in self.disk_usage.iteritems():
+        if disk_usage is None:
+            ctx.write_line("Loading...")
+            return
+        
+        for device_name, usage in disk_usage.iteritems():
             ctx.write_line("%s" % device_name)
             
-            ctx.fg_color(Screen.YELLOW).write_line("%s / %s" % (humanfriendly.format_size(usage["used"]),
-                                                                humanfriendly.format_size(usage["total"])))
+            if usage["total"] is None:
+                ctx.fg_color(Screen.RED).write_line("stale").fg_color(Screen.WHITE).linebreak()
+                continue
+            
+            if usage["stale"]:
+                ctx.fg_color(Screen.RED)
+            else:
+                ctx.fg_color(Screen.YELLOW)
+                
+            ctx.write_line("%s / %s%s" % (humanfriendly.format_size(usage["used"]),
+                                          humanfriendly.format_size(usage["total"]),
+                                          " stale" if usage["stale"] else ""))
+            
+            usage_percent = float(usage["used"]) / float(max(usage["total"], 1))
             
-            ctx.fg_color(Screen.WHITE).write("[")
+            draw_usage_bar(ctx, usage_percent, self.YELLOW_THRESHOLD, self.RED_THRESHOLD).linebreak()
+    
+    def update_partitions(self):
+        """
+        List the mounted partitions again if the mount table has changed
+        """
+        try:
+            with open(self.MOUNT_TABLE) as mount_table_file:
+                mount_table = mount_table_file.read()
+        except IOError:
+            # Without a mount table to compare, list the partitions every time
+            mount_table = None
             
-            usage_percent = float(usage["used"]) / float(usage["total"])
+        if mount_table is not None and mount_table == self.mount_table:
+            return
+        
+        self.mount_table = mount_table
+        
+        partitions = []
+        
+        for partition in psutil.disk_partitions(all=True):
+            if not partition.mountpoint or partition.fstype in self.PSEUDO_FILESYSTEMS:
+                continue
             
-            if usage_percent < self.YELLOW_THRESHOLD:
-                ctx.fg_color(Screen.GREEN)
-            elif usage_percent >= self.YELLOW_THRESHOLD and usage_percent <= self.RED_THRESHOLD:
-                ctx.fg_color(Screen.YELLOW)
-            else:
-                ctx.fg_color(Screen.RED)
+            if partition.mountpoint not in partitions:
+                partitions.append(partition.mountpoint)
                 
-            ctx.write(get_progress_bar(ctx.get_columns()-2, usage_percent)).fg_color(Screen.WHITE).write("]").linebreak()
+        self.partitions = partitions
+        
+    def check_mount(self, mountpoint):
+        try:
+            return psutil.disk_usage(mountpoint)
+        finally:
+            with self.pending_lock:
+                self.pending.discard(mountpoint)
+        
+    def fetch_disk_usage(self):
+        self.update_partitions()
+        
+        # Check the mounts at the same time, each may take up to the timeout
+        with self.pending_lock:
+            mountpoints = [ mountpoint for mountpoint in self.partitions if mountpoint not in self.pending ]
+            self.pending.update(mountpoints)
+            
+        tasks = [ (lambda mountpoint=mountpoint: self.check_mount(mountpoint)) for mountpoint in mountpoints ]
+        results = dict(zip(mountpoints, run_concurrently(tasks, max(len(tasks), 1), self.timeout)))
         
-    def update_disk_usage(self):
-        disk_partitions = psutil.disk_partitions()
+        # Unmounted filesystems are left out
+        disk_usage = OrderedDict()
         
-        for disk_partition in disk_partitions:
-            if disk_partition.mountpoint:
-                disk_usage = psutil.disk_usage(disk_partition.mountpoint)
+        for mountpoint in self.partitions:
+            usage, error = results.get(mountpoint, (None, None))
+            
+            if usage is not None:
+                disk_usage[mountpoint] = {"total": usage.total,
+                                          "used": usage.used,
+                                          "stale": False}
+            elif mountpoint in results and not isinstance(error, DeadlineExceeded):
+                # The mount can't be checked at all, eg. due to permissions
+                continue
+            else:
+                # The check is hung, keep showing the last known usage
+                previous = self.disk_usage.get(mountpoint, {"total": None, "used": None})
                 
-                self.disk_usage[disk_partition.mountpoint] = {"total": disk_usage.total,
-                                                              "used": disk_usage.used}
+                disk_usage[mountpoint] = {"total": previous["total"],
+                                          "used": previous["used"],
+                                          "stale": True}
                 
-                
\ No newline at end of file
+        self.disk_usage = disk_usage
+        
+        return disk_usage
@@ -5,5 +5,41 @@ class Tab:
         """
         self.title = "DEFAULT TITLE"
     
+    def get_collectors(self):
+        """
+        Returns the collectors that gather the data displayed by this tab.
+        They are run in the background, so render_tab should only read their snapshots
+        """
+        return []
+    
+    def get_refresh_interval(self):
+        """
+        Returns how often the tab has to be drawn again in seconds even if its data
+        hasn't changed, eg. to update a shown age. None if it only has to be
+        drawn again when its collectors publish new data
+        """
+        return None
+    
+    def get_render_cost(self):
+        """
+        Returns about how many seconds drawing the tab and sending it to the screen
+        takes. This is only used until redraws of the tab have been measured
+        """
+        return 0.05
+    
+    def get_state(self):
+        """
+        Returns what should be kept over restarts as a value json can encode,
+        or None if there's nothing to keep. Called after each collector run
+        on the thread that ran the collector
+        """
+        return None
+    
+    def restore_state(self, state):
+        """
+        Restore the state returned by get_state before the restart
+        """
+        pass
+    
     def render_tab(self, ctx):
         raise NotImplementedError("render_tab not implemented on %s!" % self.__class__.__name__)
\ No newline at end of file
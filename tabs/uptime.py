@@ -1,10 +1,16 @@
 from context import Screen, ScreenContext
 from tab import Tab
+from collector import Collector, Snapshot, run_concurrently
+from probe import DNSCache, PROBE_MODES, probe
+from stats import LatencyHistogram
+from metrics import registry
 
-import urllib2
 import time
 
-from utils import format_timespan
+from utils import format_timespan, format_latency
+
+PROBE_SECONDS = registry.histogram("showtime_website_probe_seconds", "Time taken for websites to respond",
+                                   label_names=("website",))
 
 class WebsiteUptime(Tab):
     def __init__(self, config):
@@ -12,52 +18,157 @@ class WebsiteUptime(Tab):
         
         self.websites = config["websites"]
         
+        # How many websites are checked at the same time, how long a single check
+        # may take and how long all of the checks may take in total
+        self.concurrency = config.get("concurrency", 8)
+        self.timeout = config.get("timeout", 5)
+        self.round_timeout = config.get("round_timeout", 10)
+        
+        # How websites are checked, unless a website sets its own "probe"
+        self.probe_mode = config.get("probe", "head")
+        
+        for website in self.websites:
+            mode = website.get("probe", self.probe_mode)
+            
+            if mode not in PROBE_MODES:
+                raise ValueError("Unknown probe mode %s for %s, available modes are %s" %
+                                 (mode, website["name"], ", ".join(sorted(PROBE_MODES))))
+                
+        # Websites whose 99th percentile response time is at least this many seconds are shown as slow
+        self.slow_threshold = config.get("slow_threshold", 1.0)
+        
+        self.dns_cache = DNSCache(config.get("dns_ttl", 300))
+        
+        # Recent response times of each website
+        self.latency = dict([ (website["name"], LatencyHistogram()) for website in self.websites ])
+        
         # Websites' uptime status as a bool
         self.website_status = {}
         
         # Timestamps of when websites went down
         self.downtime = {}
             
-        # Timestamp of the last update
-        self.last_update = 0
-        
         for website in self.websites:
             self.downtime[website["name"]] = -1
+            
+        self.collector = Collector("uptime", self.fetch_uptime, 60)
+        
+    def get_collectors(self):
+        return [ self.collector ]
+    
+    def get_refresh_interval(self):
+        # How long websites have been down is shown in seconds
+        return 1
+    
+    def get_state(self):
+        snapshot = self.collector.snapshot
+        
+        if snapshot.data is None:
+            return None
         
-    def update_uptime(self):
-        current_time = time.time()
+        return {"website_status": snapshot.data["website_status"],
+                "downtime": snapshot.data["downtime"],
+                "latency": dict([ (name, histogram.get_state()) for name, histogram in self.latency.items() ]),
+                "timestamp": snapshot.timestamp}
+    
+    def restore_state(self, state):
+        # Websites that are no longer configured are left out
+        website_status = {}
+        downtime = dict(self.downtime)
         
-        if current_time >= self.last_update + 60:
-            for website in self.websites:
-                # Is the website down?
-                down = False
+        for name in downtime:
+            if name in state["downtime"]:
+                downtime[name] = state["downtime"][name]
+                website_status[name] = state["website_status"][name]
                 
-                # Try to get a response
-                # If we get an exception assume the site is down
-                try:
-                    response = urllib2.urlopen(website["url"], timeout=5)
-                except:
-                    down = True
-                    
-                if not down:
-                    self.website_status[website["name"]] = True
+        for name, histogram_state in state.get("latency", {}).items():
+            if name in self.latency:
+                self.latency[name].restore_state(histogram_state)
+                
+        self.website_status = website_status
+        self.downtime = downtime
+        
+        self.collector.snapshot = Snapshot({"website_status": website_status,
+                                            "downtime": downtime,
+                                            "latency": self.get_latency_quantiles()}, state["timestamp"], None)
+        
+    def probe_website(self, website):
+        """
+        Check the website and return how long it took to respond, raising an exception if it's down
+        """
+        return probe(website["url"], website.get("probe", self.probe_mode), self.timeout, self.dns_cache)
+    
+    def get_latency_quantiles(self):
+        """
+        Returns the (50th, 99th) percentile of the recent response times of each
+        website that has responded
+        """
+        quantiles = {}
+        
+        for name, histogram in self.latency.items():
+            p50 = histogram.get_quantile(0.5)
+            
+            if p50 is not None:
+                quantiles[name] = (p50, histogram.get_quantile(0.99))
+                
+        return quantiles
+        
+    def fetch_uptime(self):
+        # Check all of the websites concurrently
+        # If we get an exception or the check doesn't finish in time assume the site is down
+        tasks = [ (lambda website=website: self.probe_website(website)) for website in self.websites ]
+        results = run_concurrently(tasks, self.concurrency, self.round_timeout)
+        
+        website_status = {}
+        downtime = dict(self.downtime)
+        
+        for website, (result, error) in zip(self.websites, results):
+            if error is None:
+                website_status[website["name"]] = True
+                
+                downtime[website["name"]] = -1
+                
+                self.latency[website["name"]].add(result)
+                PROBE_SECONDS.observe(result, website["name"])
+            else:
+                website_status[website["name"]] = False
+                
+                if downtime[website["name"]] == -1:
+                    downtime[website["name"]] = int(time.time())
                     
-                    self.downtime[website["name"]] = -1
-                else:
-                    self.website_status[website["name"]] = False
+        # Replace the previous results all at once
+        self.website_status = website_status
+        self.downtime = downtime
                     
-                    if self.downtime[website["name"]] == -1:
-                        self.downtime[website["name"]] = int(time.time())
-                        
-            self.last_update = current_time
+        return {"website_status": website_status,
+                "downtime": downtime,
+                "latency": self.get_latency_quantiles()}
                     
     def render_tab(self, ctx):
-        self.update_uptime()
+        uptime = self.collector.snapshot.data
+        
+        if uptime is None:
+            ctx.write_line("Loading...")
+            return
         
-        for website, status in self.website_status.iteritems():
+        for website, status in uptime["website_status"].iteritems():
             ctx.fg_color(Screen.WHITE).write_line(website)
             
-            if status:
+            latency = uptime["latency"].get(website)
+            
+            if status and latency is not None:
+                p50, p99 = latency
+                
+                # Slow responses are shown before they turn into an outage
+                if p50 >= self.slow_threshold:
+                    ctx.fg_color(Screen.YELLOW).write("SLOW")
+                elif p99 >= self.slow_threshold:
+                    ctx.fg_color(Screen.YELLOW).write("UP")
+                else:
+                    ctx.fg_color(Screen.GREEN).write("UP")
+                    
+                ctx.write_line(" %s p99 %s" % (format_latency(p50), format_latency(p99))).linebreak()
+            elif status:
                 ctx.fg_color(Screen.GREEN).write_line("UP").linebreak()
             else:
-                ctx.fg_color(Screen.RED).write_line("DOWN for %s" % format_timespan(int(time.time() - self.downtime[website]))).linebreak()
\ No newline at end of file
+                ctx.fg_color(Screen.RED).write_line("DOWN for %s" % format_timespan(int(time.time() - uptime["downtime"][website]))).linebreak()
\ No newline at end of file
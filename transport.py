@@ -0,0 +1,143 @@
+import os
+import errno
+import select
+import termios
+import time
+
+# Python 2's termios module doesn't define baud rates above 460800,
+# so use the value from Linux's termios.h
+BAUD_RATE = getattr(termios, "B500000", 0o010005)
+
+def configure_port(fd):
+    """
+    Set the terminal attributes the screen needs: 500000 baud and raw 8-bit
+    input and output. Returns True if the port was already configured, in which
+    case opening it didn't reset the screen
+    """
+    iflag, oflag, cflag, lflag, ispeed, ospeed, cc = termios.tcgetattr(fd)
+    
+    # HUPCL is cleared below, so a port that has it set hasn't been configured since
+    # it appeared, and raising DTR when it was opened has reset the screen
+    configured = ispeed == BAUD_RATE and ospeed == BAUD_RATE and not cflag & termios.HUPCL
+    
+    cflag |= termios.CS8
+    iflag |= termios.IGNBRK
+    iflag &= ~(termios.BRKINT | termios.ICRNL | termios.IMAXBEL | termios.IXON)
+    oflag &= ~(termios.OPOST | termios.ONLCR)
+    lflag &= ~(termios.ISIG | termios.ICANON | termios.IEXTEN | termios.ECHO | termios.ECHOE |
+               termios.ECHOK | termios.ECHOCTL | termios.ECHOKE)
+    lflag |= termios.NOFLSH
+    cflag &= ~termios.CRTSCTS
+    
+    # Keep DTR raised when the port is closed, so that opening it again doesn't reset
+    # the screen. Ignore the modem control lines and allow reading what the screen sends
+    cflag &= ~termios.HUPCL
+    cflag |= termios.CLOCAL | termios.CREAD
+    
+    termios.tcsetattr(fd, termios.TCSANOW, [ iflag, oflag, cflag, lflag, BAUD_RATE, BAUD_RATE, cc ])
+    
+    return configured
+
+class SerialTransport:
+    """
+    Keeps the serial port open as a raw file descriptor and writes
+    encoded command bytes to it directly
+    """
+    def __init__(self, port_name):
+        self.port_name = port_name
+        self.fd = None
+        
+        # Whether the port had already been configured when it was opened
+        self.was_configured = False
+        
+        # Total amount of bytes written since the port was opened
+        self.bytes_written = 0
+    
+    def open(self):
+        """
+        Opens the serial port and configures it if it's a terminal
+        """
+        self.fd = os.open(self.port_name, os.O_RDWR | os.O_NOCTTY)
+        
+        if os.isatty(self.fd):
+            try:
+                self.was_configured = configure_port(self.fd)
+            except termios.error:
+                self.close()
+                raise
+        else:
+            # Eg. a file the output is written to, which is always ready
+            self.was_configured = True
+        
+        return self
+    
+    def wait_until_ready(self, timeout):
+        """
+        Wait for the screen to start after it has been reset, which happens when
+        the port is opened for the first time. The screen doesn't answer to
+        any command, so it's considered ready once it sends something, or when
+        the timeout expires. Returns the time spent waiting
+        """
+        if self.was_configured:
+            return 0.0
+        
+        start_time = time.time()
+        deadline = start_time + timeout
+        
+        while time.time() < deadline:
+            try:
+                readable, _, _ = select.select([ self.fd ], [], [], max(deadline - time.time(), 0))
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                
+                raise
+            
+            if readable:
+                # Discard whatever the screen sent while starting up
+                os.read(self.fd, 1024)
+                break
+        
+        return time.time() - start_time
+    
+    def write(self, data):
+        """
+        Writes all of the provided bytes to the port
+        """
+        view = memoryview(data)
+        
+        while len(view) > 0:
+            try:
+                written = os.write(self.fd, view)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                elif e.errno == errno.EAGAIN:
+                    # The port's output buffer is full, wait until it can take more
+                    select.select([], [ self.fd ], [])
+                    continue
+                
+                raise e
+            
+            view = view[written:]
+            self.bytes_written += written
+        
+        return self
+    
+    def close(self):
+        """
+        Closes the serial port
+        """
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+def encode_text(text):
+    """
+    Encode text into bytes the screen can print. The screen has a single-byte
+    font, so characters it can't display are replaced to keep the column count intact
+    """
+    if isinstance(text, unicode):
+        return text.encode("ascii", "replace")
+    
+    return text
@@ -1,3 +1,5 @@
+from collections import OrderedDict
+
 def format_timespan(seconds):
     seconds = int(seconds)
     
@@ -21,23 +23,75 @@ def format_timespan(seconds):
             
     return time_str
 
+def format_latency(seconds):
+    """
+    Format a latency in milliseconds, or seconds if it's at least a second
+    """
+    if seconds < 1:
+        return "%dms" % int(seconds * 1000)
+    
+    return "%.1fs" % seconds
+
 def get_progress_bar(length, percent):
-    bar = ""
-    count = int(percent * (length))
-    
-    for i in range(0, length):
-        if float(float(i) / float(length)) <= percent:
-            bar += "|"
-        else:
-            bar += " "
-            
-    return bar
+    # A character is filled if the part of the bar it starts at is filled. percent * length
+    # can be rounded differently, so the count is corrected using that comparison
+    count = min(max(int(percent * length) + 1, 0), length)
+    
+    while count > 0 and float(count - 1) / float(length) > percent:
+        count -= 1
+        
+    while count < length and float(count) / float(length) <= percent:
+        count += 1
+        
+    return "|" * count + " " * (length - count)
+
+def get_sparkline(values, length):
+    """
+    Draw values between 0 and 1 as a line of characters, newest on the right.
+    If there are more values than characters, each character shows the
+    average of the values it covers
+    """
+    # Imported here, so that tabs that don't draw sparklines don't have to load numpy
+    import numpy
+    
+    levels = "_.:-=+*#"
+    
+    if len(values) > length:
+        edges = numpy.linspace(0, len(values), length + 1).astype(int)
+        values = numpy.add.reduceat(values, edges[:-1]) / numpy.diff(edges)
+        
+    line = "".join([ levels[min(max(int(value * len(levels)), 0), len(levels) - 1)] for value in values ])
+    
+    return line.rjust(length)
 
-def split_string_into_chunks(string, length=25):
+class LRUCache:
     """
-    Split string into chunks of defined size
+    A dict-like cache that discards the least recently used entries
+    once it holds more than max_size of them
     """
-    if len(string) <= length:
-        return [ string ]
-    else:
-        return (string[0+i:length+i] for i in range(0, len(string), length))
\ No newline at end of file
+    def __init__(self, max_size=32):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        
+    def get(self, key, default=None):
+        if key not in self.entries:
+            return default
+        
+        # Move the entry to the end as the most recently used one
+        value = self.entries.pop(key)
+        self.entries[key] = value
+        
+        return value
+    
+    def put(self, key, value):
+        self.entries.pop(key, None)
+        self.entries[key] = value
+        
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            
+    def __contains__(self, key):
+        return key in self.entries
+    
+    def __len__(self):
+        return len(self.entries)
\ No newline at end of file
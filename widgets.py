@@ -0,0 +1,108 @@
+"""
+Charts rendered as RGB565 pixel blocks for pixel mode. Blocks are cached by
+what they show once it's quantized to whole pixels, so drawing a chart that
+looks the same as before renders nothing, and the pixel buffer sends nothing
+"""
+import threading
+
+import numpy
+
+from context import Screen
+from utils import LRUCache
+
+# RGB565 color of the unfilled part of bars and gauges
+TRACK_COLOR = 0x2104
+
+# Rendered blocks by their kind, size, color and quantized values
+block_cache = LRUCache(256)
+cache_lock = threading.Lock()
+
+def get_cached(key, render):
+    """
+    Returns the cached block for the key, rendering it if it isn't cached
+    """
+    with cache_lock:
+        data = block_cache.get(key)
+    
+    if data is None:
+        data = render().astype("<u2").tobytes()
+        
+        with cache_lock:
+            block_cache.put(key, data)
+    
+    return data
+
+def clamp(value):
+    return min(max(float(value), 0.0), 1.0)
+
+def render_bar(width, height, value, color):
+    """
+    Returns a horizontal bar filled up to value between 0 and 1 with one
+    of the colors defined in Screen. The bar is framed and leaves an empty
+    row above and below it
+    """
+    filled = int(round(clamp(value) * (width - 2)))
+    
+    def render():
+        pixels = numpy.zeros((height, width), dtype=numpy.uint16)
+        
+        pixels[1:-1] = Screen.PALETTE[Screen.WHITE]
+        pixels[2:-2, 1:-1] = TRACK_COLOR
+        pixels[2:-2, 1:1+filled] = Screen.PALETTE[color]
+        
+        return pixels
+    
+    return get_cached(("bar", width, height, color, filled), render)
+
+def render_sparkline(width, height, values, color):
+    """
+    Returns values between 0 and 1 drawn as a filled line chart, newest on the right.
+    If there are more values than columns, each column shows the average of the
+    values it covers
+    """
+    values = numpy.asarray(values, dtype=float)
+    
+    if len(values) > width:
+        edges = numpy.linspace(0, len(values), width + 1).astype(int)
+        values = numpy.add.reduceat(values, edges[:-1]) / numpy.diff(edges)
+    
+    # Height of each column in pixels
+    heights = numpy.zeros(width, dtype=int)
+    heights[width - len(values):] = numpy.clip(numpy.round(values * height), 0, height)
+    
+    def render():
+        filled = numpy.arange(height)[:, None] >= height - heights[None, :]
+        
+        return numpy.where(filled, Screen.PALETTE[color], Screen.PALETTE[Screen.BLACK])
+    
+    return get_cached(("sparkline", width, height, color, heights.tostring()), render)
+
+def render_gauge(width, height, value, color):
+    """
+    Returns a half ring filled clockwise up to value between 0 and 1, centered
+    at the bottom of the block and as large as fits in it
+    """
+    # The fill is quantized to whole degrees
+    degrees = int(round(clamp(value) * 180))
+    
+    def render():
+        radius = min(width / 2.0, float(height))
+        
+        # Distance and angle of the center of each pixel from the center of the ring,
+        # with the angle growing clockwise from the left
+        y, x = numpy.mgrid[0:height, 0:width] + 0.5
+        x -= width / 2.0
+        y = height - y
+        
+        distance = numpy.hypot(x, y)
+        angle = 180 - numpy.degrees(numpy.arctan2(y, x))
+        
+        ring = (distance <= radius) & (distance >= radius * 0.6)
+        
+        pixels = numpy.zeros((height, width), dtype=numpy.uint16)
+        pixels[ring] = TRACK_COLOR
+        pixels[ring & (angle <= degrees)] = Screen.PALETTE[color]
+        
+        return pixels
+    
+    return get_cached(("gauge", width, height, color, degrees), render)
@@ -0,0 +1,188 @@
+from collections import deque
+
+import threading
+import time
+
+from metrics import registry, THROUGHPUT_BUCKETS
+
+SERIAL_BYTES = registry.counter("showtime_serial_bytes_total", "Bytes sent to the screen")
+SERIAL_BYTES_PER_SECOND = registry.histogram("showtime_serial_bytes_per_second",
+                                             "How fast queued output was sent to the screen",
+                                             buckets=THROUGHPUT_BUCKETS)
+
+class SerialWriter:
+    """
+    Sends queued output to the screen on its own thread as fast as the pacer
+    allows, so that the next frame can be drawn while the previous one is being sent.
+    
+    The queue holds at most max_queued_bytes, after which put() blocks until there's
+    room. Frames aren't dropped when the queue is full, as each one only contains what
+    changed since the previous one. Instead, whatever has to be drawn while blocked is
+    drawn as a single frame once there's room
+    """
+    def __init__(self, transport, pacer, max_queued_bytes=2048):
+        self.transport = transport
+        self.pacer = pacer
+        self.max_queued_bytes = max_queued_bytes
+        
+        # Byte strings to write and delays to wait as floats
+        self.queue = deque()
+        self.queued_bytes = 0
+        
+        # Whether an item taken from the queue is being written
+        self.busy = False
+        
+        # The error writing failed with, raised on the next put
+        self.error = None
+        self.stopped = False
+        
+        self.condition = threading.Condition()
+        self.thread = None
+        
+        # Total amount of bytes queued and time spent waiting for room in the queue
+        self.bytes_queued = 0
+        self.time_blocked = 0.0
+    
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="serial-writer")
+        self.thread.daemon = True
+        self.thread.start()
+        
+        return self
+    
+    def check_error(self):
+        if self.error is not None:
+            raise self.error
+    
+    def put(self, data):
+        """
+        Queue bytes to be written, waiting until there's room for them. Data larger
+        than the queue, such as an image, is queued once the queue is empty
+        """
+        with self.condition:
+            start_time = time.time()
+            
+            while self.error is None and self.queued_bytes > 0 and \
+                  self.queued_bytes + len(data) > self.max_queued_bytes:
+                self.condition.wait()
+            
+            self.time_blocked += time.time() - start_time
+            
+            self.check_error()
+            
+            self.queue.append(data)
+            self.queued_bytes += len(data)
+            self.bytes_queued += len(data)
+            
+            self.condition.notify_all()
+    
+    def put_delay(self, period):
+        """
+        Queue a delay, which is waited after the bytes queued before it have been written
+        """
+        with self.condition:
+            self.check_error()
+            
+            self.queue.append(float(period))
+            self.condition.notify_all()
+    
+    def drain(self, timeout=None):
+        """
+        Wait until everything queued has been written. Returns False if the timeout expired
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        
+        with self.condition:
+            while self.error is None and (self.queue or self.busy):
+                if deadline is None:
+                    self.condition.wait()
+                elif time.time() < deadline:
+                    self.condition.wait(deadline - time.time())
+                else:
+                    return False
+            
+            self.check_error()
+        
+        return True
+    
+    def stop(self, timeout=0):
+        """
+        Stop the writer thread once the queue is empty, waiting for it to
+        stop for at most timeout seconds
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+            
+        if timeout > 0 and self.thread is not None:
+            self.thread.join(timeout)
+    
+    def run(self):
+        # When the writer started sending what it has sent since it was last idle
+        busy_start_time = None
+        busy_bytes = 0
+        
+        while True:
+            with self.condition:
+                while not self.queue and not self.stopped:
+                    self.condition.wait()
+                
+                if not self.queue:
+                    return
+                
+                item = self.queue.popleft()
+                self.busy = True
+            
+            if busy_start_time is None:
+                busy_start_time = time.time()
+            
+            try:
+                if isinstance(item, float):
+                    self.pacer.wait(item)
+                else:
+                    self.write(item)
+            except (IOError, OSError) as e:
+                with self.condition:
+                    self.error = e
+                    self.queue.clear()
+                    self.queued_bytes = 0
+                    self.busy = False
+                    
+                    self.condition.notify_all()
+                
+                return
+            
+            with self.condition:
+                if not isinstance(item, float):
+                    self.queued_bytes -= len(item)
+                    busy_bytes += len(item)
+                
+                self.busy = False
+                idle = not self.queue
+                
+                self.condition.notify_all()
+            
+            if idle:
+                elapsed = time.time() - busy_start_time
+                
+                if busy_bytes > 0 and elapsed > 0:
+                    SERIAL_BYTES_PER_SECOND.observe(busy_bytes / elapsed)
+                
+                busy_start_time = None
+                busy_bytes = 0
+    
+    def write(self, data):
+        """
+        Write the bytes in bursts the screen can keep up with
+        """
+        burst_size = self.pacer.profile.burst_size
+        
+        for i in range(0, len(data), burst_size):
+            chunk = data[i:i+burst_size]
+            
+            self.pacer.consume(len(chunk))
+            self.transport.write(chunk)
+            
+            SERIAL_BYTES.inc(len(chunk))